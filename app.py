@@ -4,10 +4,37 @@ from telebot import types
 from flask_sqlalchemy import SQLAlchemy
 import requests
 import csv
+import io
+import codecs
+import itertools
+import zlib
+import struct
 import re
+import os
+import bisect
+import sys
+import mmap
+import json
+import hashlib
+import time
+import threading
+import queue
+from array import array
+import calendar
+import datetime
+import multiprocessing
+import concurrent.futures
+from collections import OrderedDict, Counter
 
 import config
 
+# optional, the EOD check of an uploaded dispatch list is vectorized with it
+try:
+    import numpy
+    import pandas
+except ImportError:
+    pandas = None
+
 # ======================================================================================================================
 # config initialisation
 telebot_secret = config.telebot_secret
@@ -17,6 +44,26 @@ admin_bot_list = config.admin_bot_list
 
 # Unique Identifiers initialisation from config
 scac = config.scac
+# tenant name -> settings, see config_example.py. A bot without tenants is the one tenant of scac,
+# its log stays in temp/
+tenant_settings = getattr(config, 'tenants', None) or {scac: {'scac': scac, 'path': 'temp/'}}
+
+# Optional features
+completed_moves_in_db = getattr(config, 'completed_moves_in_db', False)
+completed_moves_mmap = getattr(config, 'completed_moves_mmap', False)
+completed_moves_snapshots_kept = getattr(config, 'completed_moves_snapshots_kept', 5)
+completed_moves_partitions_cached = getattr(config, 'completed_moves_partitions_cached', 6)
+# Telegram bots can't download files bigger than 20MB anyway
+completed_moves_max_upload_size = getattr(config, 'completed_moves_max_upload_size', 20 * 1024 * 1024)
+completed_moves_max_unpacked_size = getattr(config, 'completed_moves_max_unpacked_size', 200 * 1024 * 1024)
+completed_moves_near_matches = getattr(config, 'completed_moves_near_matches', False)
+eod_results_cached = getattr(config, 'eod_results_cached', 100)
+eod_session_debounce = getattr(config, 'eod_session_debounce', 2)
+eod_document_threshold = getattr(config, 'eod_document_threshold', 50)
+eod_batch_processes = getattr(config, 'eod_batch_processes', 0)
+eod_batch_max_days = getattr(config, 'eod_batch_max_days', 31)
+search_page_size = getattr(config, 'search_page_size', 20)
+search_results_cached = getattr(config, 'search_results_cached', 100)
 
 # ======================================================================================================================
 # MySQL initialisation
@@ -33,6 +80,10 @@ bot.set_webhook(url=url, drop_pending_updates=True)
 for bot_admin in admin_bot_list:
     bot.send_message(bot_admin, 'Bot has been restarted', disable_notification=True, reply_markup=None)
 
+# pooled connection for downloading the files users send, (connect, read) timeout in seconds
+download_session = requests.Session()
+download_timeout = (5, 60)
+
 # ======================================================================================================================
 # Flask app as a web application, have ho idea how this works in detail, but it handles all to bot connections
 # including: Telegram API, Site connections, Personal POST requests through Postman
@@ -54,6 +105,8 @@ class Users(db.Model):
     position_in_menu = db.Column(db.Integer, default='-2')
     current_customer = db.Column(db.String(20), default='Target')
     current_shift = db.Column(db.String(2), default='AM')
+    # name of the tenant the user belongs to, None - the first one in the config
+    tenant = db.Column(db.String(16))
 
     def __init__(self, **kwargs):
         for property, value in kwargs.items():
@@ -70,6 +123,54 @@ class Users(db.Model):
         return str(self.id)
 
 
+# database model of the completed moves log, only filled when completed_moves_in_db is set in the config,
+# so several worker processes share one indexed copy instead of each parsing the file
+class CompletedMove(db.Model):
+    __tablename__ = 'completed_moves'
+
+    tenant = db.Column(db.String(16), primary_key=True)
+    # position of the row in the tenant's log, keeps the log order
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.String(16))
+    year_helper = db.Column(db.String(8))
+    driver_name = db.Column(db.String(64))
+    move_id = db.Column(db.String(32), index=True)
+    container_number = db.Column(db.String(16))
+    inbound_or_outbound = db.Column(db.String(16))
+    load_status = db.Column(db.String(16))
+    shift_to_move = db.Column(db.String(8))
+    status = db.Column(db.String(16))
+    created_date = db.Column(db.String(32), index=True)
+    # "YYYY-MM" of the row, '' when it can't be dated
+    partition = db.Column(db.String(7), index=True)
+    # upper case container number, its serial(everything after the owner code) and the number reversed, the
+    # container searches of a partition index(start, serial, end of the number) are range queries on them
+    container_key = db.Column(db.String(16), index=True)
+    container_serial = db.Column(db.String(16), index=True)
+    container_reversed = db.Column(db.String(16), index=True)
+
+    # same column order as the csv
+    def to_row(self):
+        return [self.month, self.year_helper, self.driver_name, self.move_id, self.container_number,
+                self.inbound_or_outbound, self.load_status, self.shift_to_move, self.status, self.created_date]
+
+    def __repr__(self):
+        return self.move_id
+
+
+# last 4 keys of the Move IDs of the completed_moves table, a row per key(see last_4_keys())
+class CompletedMoveLast4(db.Model):
+    __tablename__ = 'completed_move_last_4s'
+
+    tenant = db.Column(db.String(16), primary_key=True)
+    # id of the completed_moves row
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_4 = db.Column(db.String(4), primary_key=True, index=True)
+
+    def __repr__(self):
+        return self.last_4
+
+
 db.create_all()
 
 
@@ -82,6 +183,1443 @@ def telegram_webhook():
     return 'ok', 200
 
 
+# ======================================================================================================================
+# Completed moves log
+
+completed_moves_header = ['Month', 'Year Helper', 'Driver Name (Last, First)', 'Unique Move ID', 'Container Number',
+                          'Inbound or Outbound', 'Load Status', 'Shift to move', 'Status', 'Created date']
+
+
+# Column store of the completed moves rows, rows are rebuilt as lists only when asked for.
+# Repetitive columns(Month, Year Helper, Inbound or Outbound, Load Status, Shift to move, Status) are dictionary
+# encoded: a small integer array of codes into the list of their distinct values. Driver, Move ID, Container Number
+# and Created date(with the time) are close to unique, they are kept as plain lists of strings
+class CompactRows:
+    __slots__ = ('columns', 'values', 'codes')
+
+    encoded_columns = (0, 1, 5, 6, 7, 8)
+
+    def __init__(self, rows=()):
+        self.columns = [array('B') if i in self.encoded_columns else [] for i in range(len(completed_moves_header))]
+        self.values = [[] for i in range(len(completed_moves_header))]
+        self.codes = [{} for i in range(len(completed_moves_header))]
+
+        for row in rows:
+            self.append(row)
+
+    def encode(self, column, value):
+        code = self.codes[column].get(value)
+        if code is None:
+            code = self.codes[column][value] = len(self.values[column])
+            self.values[column].append(value)
+
+            # widen the array once the distinct values don't fit anymore
+            if code == 256 and self.columns[column].typecode == 'B':
+                self.columns[column] = array('H', self.columns[column])
+            elif code == 65536 and self.columns[column].typecode == 'H':
+                self.columns[column] = array('I', self.columns[column])
+
+        return code
+
+    def append(self, row):
+        for column, value in enumerate(row):
+            # encoded first, encode() may replace the column with a wider array
+            if column in self.encoded_columns:
+                value = self.encode(column, value)
+            self.columns[column].append(value)
+
+    def __setitem__(self, position, row):
+        for column, value in enumerate(row):
+            if column in self.encoded_columns:
+                value = self.encode(column, value)
+            self.columns[column][position] = value
+
+    def __getitem__(self, position):
+        return [self.values[column][codes[position]] if column in self.encoded_columns else codes[position]
+                for column, codes in enumerate(self.columns)]
+
+    def copy(self):
+        new = CompactRows()
+        new.columns = [i[:] for i in self.columns]
+        new.values = [i[:] for i in self.values]
+        new.codes = [dict(i) for i in self.codes]
+        return new
+
+    def __len__(self):
+        return len(self.columns[3])
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    # bytes held by the store
+    def memory_size(self):
+        size = sys.getsizeof(self.columns) + sys.getsizeof(self.values) + sys.getsizeof(self.codes)
+        for column in range(len(self.columns)):
+            size += sys.getsizeof(self.columns[column]) + sys.getsizeof(self.values[column])
+            size += sys.getsizeof(self.codes[column])
+            size += sum(sys.getsizeof(i) for i in self.values[column])
+            if column not in self.encoded_columns:
+                size += sum(sys.getsizeof(i) for i in self.columns[column])
+        return size
+
+
+# Rows of the verified file read straight from a memory map of it, only the byte offset of every row is kept
+# in memory and a row is decoded when asked for, so resident memory doesn't grow with the row fields.
+# The file must never be written in place while mapped, uploads replace it with os.replace
+class MappedRows:
+    __slots__ = ('file', 'map', 'offsets', 'overlay', 'appended')
+
+    # offsets are given when they were recorded while the file was written, otherwise scan() records them
+    def __init__(self, file_path, offsets=None):
+        self.file = open(file_path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        # start of every row plus the end of the last one
+        self.offsets = array('Q') if offsets is None else offsets
+        # rows merged in after the file was mapped, position -> row
+        self.overlay = {}
+        self.appended = 0
+
+    # one pass over the file recording the row offsets, yields the parsed rows(header excluded) to be indexed
+    def scan(self):
+        self.map.seek(0)
+        self.map.readline()
+        offset = self.map.tell()
+        self.offsets.append(offset)
+
+        record = b''
+        for line in iter(self.map.readline, b''):
+            record += line
+            # a quoted field with a new line in it, the row goes on
+            if record.count(b'"') % 2:
+                continue
+
+            offset += len(record)
+            row = next(csv.reader([record.decode('utf-8')]), None)
+            record = b''
+
+            if not row:
+                # blank line, glue it to the previous row
+                self.offsets[-1] = offset
+                continue
+
+            self.offsets.append(offset)
+            yield row
+
+    def append(self, row):
+        self.overlay[len(self)] = list(row)
+        self.appended += 1
+
+    def __setitem__(self, position, row):
+        self.overlay[position] = list(row)
+
+    def __getitem__(self, position):
+        if position in self.overlay:
+            return list(self.overlay[position])
+        return next(csv.reader([self.map[self.offsets[position]:self.offsets[position + 1]].decode('utf-8')]))
+
+    def __len__(self):
+        return len(self.offsets) - 1 + self.appended
+
+    # the mapped file and the offsets never change, only the overlay is copied
+    def copy(self):
+        new = MappedRows.__new__(MappedRows)
+        new.file = self.file
+        new.map = self.map
+        new.offsets = self.offsets
+        new.overlay = dict(self.overlay)
+        new.appended = self.appended
+        return new
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    # bytes held in memory, the mapped pages belong to the page cache
+    def memory_size(self):
+        return sys.getsizeof(self.offsets) + rows_list_memory_size(self.overlay.values())
+
+
+# bytes the rows take as the list of csv.reader lists they used to be kept in, every field is a separate string there
+def rows_list_memory_size(rows):
+    size = sys.getsizeof([None] * len(rows))
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(i) for i in row)
+    return size
+
+
+# Bytes held by the lookups of an index(rows excluded): the dicts, their position lists/tuples and the keys that
+# aren't strings of the rows(last 4, dates, sorted container keys, near matches)
+def index_memory_size(index):
+    size = 0
+    for name in ('move_ids', 'last_4', 'containers', 'dates'):
+        size += sys.getsizeof(index[name])
+        size += sum(sys.getsizeof(i) for i in index[name].values() if type(i) is not int)
+    size += sum(sys.getsizeof(i) for name in ('last_4', 'dates') for i in index[name])
+
+    for name in ('container_prefixes', 'container_serials', 'container_suffixes'):
+        keys, containers = index.get(name, ([], []))
+        size += sys.getsizeof(keys) + (sys.getsizeof(containers) if containers is not keys else 0)
+        if name != 'container_prefixes':
+            size += sum(sys.getsizeof(i) for i in keys)
+
+    for near in (index.get('near') or {}).values():
+        size += sys.getsizeof(near) + sum(sys.getsizeof(key) + (sys.getsizeof(keys) if type(keys) is tuple else 0)
+                                          for key, keys in near.items())
+
+    return size
+
+
+# Indexes of the last used partitions of the completed moves log(rows of one Year Helper/Month), most recently used
+# last, keyed by the files of the partition so the partitions a merge didn't change are shared between snapshots.
+# EOD and search only load the partitions in their scope, the others are dropped from memory and read again when
+# asked for. Every index is a dict of:
+# version - the snapshot the index was built for
+# scac - of the tenant the index belongs to
+# partition - the partition key, see partition_key()
+# rows - verified rows in file order(header excluded), as CompactRows or MappedRows
+# move_ids - Move ID -> position in rows, or a tuple of all of its positions(in order) for the ID's found more than
+#            once, no list per ID for the common single row case
+# last_4 - 4 characters right before the scac in a Move ID -> positions in rows
+# containers - upper case container number -> positions in rows
+# dates - Created date(without the time) as in the log -> positions in rows
+# container_prefixes, container_serials, container_suffixes - (sorted keys, container of each key) to answer owner
+# code / start of the number, serial(everything after the owner code) and end of the number queries with bisect
+# near - only with completed_moves_near_matches, built the first time an EOD looks for a suggestion in the partition,
+#        see get_near_keys()
+# files - the cache key(base file and delta files of the partition), set once the index is cached
+# Every tenant has its own log, in its own folder(path setting, temp/<tenant name>/ by default), and its own partition
+# cache and locks. A tenant is a dict of:
+# name, scac, smartsheet_form - id of the bobtail form
+# snapshots_path, pointer_path - every upload is published as a new immutable snapshot: its files and
+#                                a <version>.json manifest in the snapshots folder, the current one is the version
+#                                written in the pointer file(swapped with os.replace)
+# file_path, delta_file_path - log of a bot from before the snapshots, becomes the first snapshot
+# partitions, partitions_lock - the partition indexes described above
+# upload_lock - snapshots are published one at a time, a merge has to build on the one published before it
+def new_tenant(name, settings):
+    path = settings.get('path', 'temp/' + name + '/')
+
+    return {'name': name, 'scac': settings['scac'],
+            'smartsheet_form': settings.get('smartsheet_form', 'f6aacf211b2a4f10ae3bda2cfc6bce2a'),
+            'snapshots_path': path + 'snapshots/', 'pointer_path': path + 'completed_moves_current',
+            'file_path': path + 'completed_moves_verified.csv', 'delta_file_path': path + 'completed_moves_delta.csv',
+            'partitions': OrderedDict(), 'partitions_lock': threading.Lock(), 'upload_lock': threading.RLock()}
+
+
+tenants = OrderedDict((name, new_tenant(name, settings)) for name, settings in tenant_settings.items())
+
+# admins looking at an earlier snapshot, telegram id -> snapshot version
+as_of_snapshots = {}
+
+# months of the log EOD and search look at, telegram id -> months(0 - all of them)
+search_scopes = {}
+search_scope_default = 2
+search_scope_options = [2, 6, 12, 0]
+
+month_numbers = {}
+for number, name in enumerate(calendar.month_name):
+    if name:
+        month_numbers[name.lower()] = number
+        month_numbers[name[:3].lower()] = number
+
+
+# Split sorted (key, container) pairs into the two lists bisect works on
+def build_sorted_container_keys(pairs):
+    pairs.sort()
+    return [i[0] for i in pairs], [i[1] for i in pairs]
+
+
+# The 4 characters right before every scac occurrence in a Move ID,
+# the same ID's "last 4 + scac" used to match anywhere in the ID
+def last_4_keys(move_id, scac):
+    keys = []
+    start = move_id.find(scac, 4)
+    while start != -1:
+        if move_id[start - 4:start] not in keys:
+            keys.append(move_id[start - 4:start])
+        start = move_id.find(scac, start + 1)
+    return keys
+
+
+# Keys of a deletion neighbourhood, the key with each of its characters deleted
+def deletion_keys(key):
+    return {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+def add_near_key(near, key):
+    for variant in deletion_keys(key):
+        keys = near.setdefault(variant, key)
+        if keys == key:
+            continue
+        near[variant] = keys + (key,) if type(keys) is tuple else (keys, key)
+
+
+# Keys with the deletion key, in the order they were added
+def near_key_values(near, variant):
+    keys = near.get(variant, ())
+    return keys if type(keys) is tuple else (keys,)
+
+
+# Deletion neighbourhood of the Move IDs and containers of a partition: every key with one character deleted -> key,
+# or a tuple of keys, to suggest what a mistyped one was meant to be. It takes several times the memory of the rows,
+# so it is built the first time it is needed and kept with the cached index(a merge builds a new index without it)
+def get_near_keys(index):
+    near = index.get('near')
+    if near is None:
+        near = {'move_ids': {}, 'containers': {}}
+        for key in index['move_ids']:
+            add_near_key(near['move_ids'], key)
+        for key in index['containers']:
+            add_near_key(near['containers'], key)
+        index['near'] = near
+
+    return near
+
+
+# Whether a and b are one typo apart: a character wrong, missing or extra, or two next to each other swapped
+def one_typo_apart(a, b):
+    if len(a) == len(b):
+        differences = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(differences) == 1 or (len(differences) == 2 and differences[1] == differences[0] + 1 and
+                                         a[differences[0]] == b[differences[1]] and
+                                         a[differences[1]] == b[differences[0]])
+
+    if abs(len(a) - len(b)) != 1:
+        return False
+
+    short, long = (a, b) if len(a) < len(b) else (b, a)
+    i = 0
+    while i < len(short) and short[i] == long[i]:
+        i += 1
+    return short[i:] == long[i + 1:]
+
+
+# Keys of the index one typo away from the text. Keys and text sharing a deletion key(or one being the deletion
+# key of the other) are the only candidates, no key is compared with the text unless it is one of them
+def near_keys(near, keys, text):
+    candidates = set(near_key_values(near, text))
+    for variant in deletion_keys(text):
+        candidates.update(near_key_values(near, variant))
+        if variant in keys:
+            candidates.add(variant)
+
+    return sorted(i for i in candidates if i != text and one_typo_apart(i, text))
+
+
+# ISO 6346 value of every letter of a container number, multiples of 11 are skipped
+iso_6346_letter_values = {}
+letter_value = 10
+for letter in 'ABCDEFGHIJKLMNOPQRSTUVWXYZ':
+    if letter_value % 11 == 0:
+        letter_value += 1
+    iso_6346_letter_values[letter] = letter_value
+    letter_value += 1
+
+
+# ISO 6346 check digit of a container number(owner code, equipment category, 6 digit serial, with or without the
+# check digit), None if it isn't one
+def container_check_digit(container):
+    if not re.fullmatch(r'[A-Z]{3}[UJZ][0-9]{6}[0-9]?', container):
+        return None
+
+    total = 0
+    for i, char in enumerate(container[:10]):
+        total += (int(char) if char.isdigit() else iso_6346_letter_values[char]) * 2 ** i
+    return str(total % 11 % 10)
+
+
+# Empty index to add rows to, rows are kept by the store given or a new CompactRows
+def new_completed_moves_index(version, scac, partition='', store=None):
+    return {'version': version, 'scac': scac, 'partition': partition,
+            'rows': CompactRows() if store is None else store,
+            'move_ids': {}, 'last_4': {}, 'containers': {}, 'dates': {}}
+
+
+# Index the row at the given position of the store
+def index_completed_move(index, position, row):
+    positions = index['move_ids'].get(row[3])
+    if positions is None:
+        index['move_ids'][row[3]] = position
+    elif type(positions) is tuple:
+        index['move_ids'][row[3]] = positions + (position,)
+    else:
+        index['move_ids'][row[3]] = (positions, position)
+
+    for key in last_4_keys(row[3], index['scac']):
+        index['last_4'].setdefault(key, []).append(position)
+
+    if row[4]:
+        index['containers'].setdefault(row[4].upper(), []).append(position)
+
+    index['dates'].setdefault(row[9].split(' ')[0], []).append(position)
+
+
+# Sorted container keys, once every row is indexed
+def finish_completed_moves_index(index):
+    container_prefixes = sorted(index['containers'])
+    index['container_prefixes'] = (container_prefixes, container_prefixes)
+    index['container_serials'] = build_sorted_container_keys([(i[4:], i) for i in index['containers']])
+    index['container_suffixes'] = build_sorted_container_keys([(i[::-1], i) for i in index['containers']])
+    return index
+
+
+# Build the index from the verified rows, any iterable of csv rows works so a reader doesn't have to be listed first.
+# Rows are copied into a new CompactRows unless a store already holding them(MappedRows) is given
+def build_completed_moves_index(rows, version, scac, store=None, partition=''):
+    new_store = store is None
+    index = new_completed_moves_index(version, scac, partition, store)
+
+    # blank lines are skipped
+    for position, row in enumerate(i for i in rows if i):
+        if new_store:
+            index['rows'].append(row)
+        index_completed_move(index, position, row)
+
+    return finish_completed_moves_index(index)
+
+
+# All positions of a move_ids value
+def move_id_positions(positions):
+    return positions if type(positions) is tuple else (positions,)
+
+
+# Position of the row used for a Move ID, the last one wins, same as the log has always been read
+def move_id_position(positions):
+    return positions[-1] if type(positions) is tuple else positions
+
+
+# Insert or remove a container in one of the (sorted keys, container of each key) lists
+def add_container_key(sorted_keys, key, container):
+    keys, containers = sorted_keys
+    i = bisect.bisect_left(keys, key)
+    keys.insert(i, key)
+    if containers is not keys:
+        containers.insert(i, container)
+
+
+def remove_container_key(sorted_keys, key, container):
+    keys, containers = sorted_keys
+    i = bisect.bisect_left(keys, key)
+    while containers[i] != container:
+        i += 1
+    del keys[i]
+    if containers is not keys:
+        del containers[i]
+
+
+# New index with the delta rows merged in by Move ID, a known Move ID has its(last) row replaced and a new one is
+# appended. The index given is left untouched for whoever still reads it, only the delta rows are indexed.
+# Returns the new index and the changed rows as {position: row}
+def merge_completed_moves_index(index, rows, version):
+    store = index['rows'].copy()
+    move_ids = dict(index['move_ids'])
+    last_4 = dict(index['last_4'])
+    containers = dict(index['containers'])
+    dates = dict(index['dates'])
+    container_prefixes = index['container_prefixes'][0][:]
+    sorted_container_keys = {'container_prefixes': (container_prefixes, container_prefixes),
+                             'container_serials': tuple(i[:] for i in index['container_serials']),
+                             'container_suffixes': tuple(i[:] for i in index['container_suffixes'])}
+    changed = {}
+
+    for row in (i for i in rows if i):
+        positions = move_ids.get(row[3])
+        old_container = ''
+        old_date = None
+
+        if positions is None:
+            position = move_ids[row[3]] = len(store)
+            store.append(row)
+            for key in last_4_keys(row[3], index['scac']):
+                last_4[key] = last_4.get(key, []) + [position]
+        else:
+            position = move_id_position(positions)
+            old_container = store[position][4].upper()
+            old_date = store[position][9].split(' ')[0]
+            store[position] = row
+
+        changed[position] = row
+
+        # lists are replaced, never changed, they are shared with the previous index
+        new_date = row[9].split(' ')[0]
+        if old_date != new_date:
+            if old_date is not None:
+                dates[old_date] = [i for i in dates[old_date] if i != position]
+                if not dates[old_date]:
+                    del dates[old_date]
+            dates[new_date] = sorted(dates.get(new_date, []) + [position])
+
+        new_container = row[4].upper()
+        if old_container == new_container:
+            continue
+
+        if old_container:
+            containers[old_container] = [i for i in containers[old_container] if i != position]
+            if not containers[old_container]:
+                del containers[old_container]
+                remove_container_key(sorted_container_keys['container_prefixes'], old_container, old_container)
+                remove_container_key(sorted_container_keys['container_serials'], old_container[4:], old_container)
+                remove_container_key(sorted_container_keys['container_suffixes'], old_container[::-1], old_container)
+
+        if new_container:
+            if new_container not in containers:
+                add_container_key(sorted_container_keys['container_prefixes'], new_container, new_container)
+                add_container_key(sorted_container_keys['container_serials'], new_container[4:], new_container)
+                add_container_key(sorted_container_keys['container_suffixes'], new_container[::-1], new_container)
+            containers[new_container] = sorted(containers.get(new_container, []) + [position])
+
+    # a merge never adds a Move ID twice, the duplicates stay as they are
+    return dict(index, version=version, rows=store, move_ids=move_ids, last_4=last_4, containers=containers,
+                dates=dates, near=None, **sorted_container_keys), changed
+
+
+# Statistics of a partition, counted while its rows are indexed and kept in the snapshot manifest:
+# rows, duplicate_move_ids - rows with a Move ID an earlier row already has(the last one is the one used),
+# wrong_scac - Move IDs not ending with the scac, empty_containers, statuses/shifts - rows per Status/Shift to move
+def new_completed_moves_stats():
+    return {'rows': 0, 'duplicate_move_ids': 0, 'wrong_scac': 0, 'empty_containers': 0, 'statuses': {}, 'shifts': {}}
+
+
+# Count a row in(+1) or out(-1) of the statistics
+def count_completed_move(stats, row, scac, count=1):
+    stats['rows'] += count
+    if not row[3].endswith(scac):
+        stats['wrong_scac'] += count
+    if not row[4]:
+        stats['empty_containers'] += count
+
+    for key, value in (('statuses', row[8]), ('shifts', row[7])):
+        stats[key][value] = stats[key].get(value, 0) + count
+        if not stats[key][value]:
+            del stats[key][value]
+
+
+# Duplicates are only known from the finished index
+def count_duplicate_move_ids(stats, index):
+    stats['duplicate_move_ids'] = sum(len(i) - 1 for i in index['move_ids'].values() if type(i) is tuple)
+    return stats
+
+
+# Statistics of a partition from a snapshot published before they were kept, the rows are counted again
+def read_partition_stats(tenant, version, key, partition):
+    index = get_partition_index(tenant, version, key, partition)
+    stats = new_completed_moves_stats()
+    for row in index['rows']:
+        count_completed_move(stats, row, tenant['scac'])
+    return count_duplicate_move_ids(stats, index)
+
+
+# Statistics of a whole snapshot, the partition ones added up
+def snapshot_stats(tenant, manifest):
+    total = new_completed_moves_stats()
+    # only the rows the upload of the snapshot itself skipped
+    total['skipped_rows'] = manifest.get('skipped_rows', 0)
+    for key, partition in manifest['partitions'].items():
+        stats = partition.get('stats') or read_partition_stats(tenant, manifest['version'], key, partition)
+        for i in ('rows', 'duplicate_move_ids', 'wrong_scac', 'empty_containers'):
+            total[i] += stats[i]
+        for i in ('statuses', 'shifts'):
+            for value, count in stats[i].items():
+                total[i][value] = total[i].get(value, 0) + count
+
+    return total
+
+
+def completed_moves_stats_report(stats):
+    report = 'Rows: ' + str(stats['rows']) + '\n' \
+             'Duplicate Move IDs: ' + str(stats['duplicate_move_ids']) + '\n' \
+             'Wrong scac: ' + str(stats['wrong_scac']) + '\n' \
+             'Empty containers: ' + str(stats['empty_containers'])
+    if stats.get('skipped_rows'):
+        report += '\nSkipped rows(wrong number of fields): ' + str(stats['skipped_rows'])
+
+    for title, key in (('Status', 'statuses'), ('Shift', 'shifts')):
+        report += '\n' + title + ':'
+        for value, count in sorted(stats[key].items(), key=lambda i: -i[1]):
+            report += '\n  ' + (value or '(empty)') + ': ' + str(count)
+
+    return report
+
+
+# csv file of a snapshot written row by row, keeping the byte offset of every row plus the end of the last one
+# for MappedRows, and the Move IDs of its rows in a <file>.ids file next to it(see read_partition_move_ids).
+# The files only show up under their names once they are closed
+class SnapshotFile:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.file = open(file_path + '.tmp', 'wb')
+        self.ids_file = open(file_path + '.ids.tmp', 'w', encoding='utf-8')
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+        # the header has no Move ID
+        self.writer.writerow(completed_moves_header)
+        self.file.write(self.buffer.getvalue().encode('utf-8'))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.offsets = array('Q', [self.file.tell()])
+
+    def write(self, row):
+        self.writer.writerow(row)
+        self.file.write(self.buffer.getvalue().encode('utf-8'))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.offsets.append(self.file.tell())
+        self.ids_file.write(row[3] + '\n')
+
+    def close(self):
+        self.file.close()
+        self.ids_file.close()
+        os.replace(self.file_path + '.ids.tmp', self.file_path + '.ids')
+        os.replace(self.file_path + '.tmp', self.file_path)
+
+    # an upload that fails before it is published leaves no file behind
+    def discard(self):
+        self.file.close()
+        self.ids_file.close()
+        for name in (self.file_path, self.file_path + '.ids'):
+            for file_path in (name + '.tmp', name):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+
+def write_json_atomically(file_path, data):
+    with open(file_path + '.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(file_path + '.tmp', file_path)
+
+
+# Snapshot manifest:
+# version, created, type - "full" or "merge" upload, rows - row count,
+# skipped_rows - rows of the upload without the header's number of fields,
+# db_version - the version the completed_moves table holds, only when the snapshot's upload loaded or merged its rows
+#              into it(the table is only read while it holds the current snapshot),
+# partitions - partition key -> {rows, base - verified file of the partition,
+#                                deltas - files of the merge uploads applied on top of it, in order}
+def read_snapshot_manifest(tenant, version):
+    with open(tenant['snapshots_path'] + version + '.json', 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+
+    # a snapshot from before the partitions is one undated partition
+    if 'partitions' not in manifest:
+        manifest['partitions'] = {'': {'rows': manifest['rows'], 'base': manifest.pop('base'),
+                                       'deltas': manifest.pop('deltas')}}
+
+    return manifest
+
+
+# Manifests of the kept snapshots, newest first
+def list_snapshots(tenant):
+    if not os.path.exists(tenant['snapshots_path']):
+        return []
+
+    versions = [i[:-5] for i in os.listdir(tenant['snapshots_path']) if i.endswith('.json')]
+    return [read_snapshot_manifest(tenant, i) for i in sorted(versions, reverse=True)]
+
+
+# Versions sort in publishing order
+def new_snapshot_version():
+    return str(time.time_ns())
+
+
+def completed_moves_log_exists(tenant):
+    return os.path.exists(tenant['pointer_path']) or os.path.exists(tenant['file_path'])
+
+
+# Partition of a row, "YYYY-MM" out of its Year Helper and Month(name or number), '' when it can't be dated
+def partition_key(row):
+    month = row[0].strip().lower()
+    month = month_numbers.get(month) or (int(month) if month.isdigit() else 0)
+    year = row[1].strip()
+
+    if not (1 <= month <= 12 and len(year) == 4 and year.isdigit()):
+        return ''
+
+    return year + '-' + str(month).zfill(2)
+
+
+# Partitions in the scope of the last months(0 - all of them), oldest first. The current month is this one,
+# or the newest one of the log when it's older(an earlier snapshot). Undated rows are always in
+def scope_partitions(partitions, months):
+    dated = sorted(i for i in partitions if i)
+    undated = [''] if '' in partitions else []
+    if not months or not dated:
+        return undated + dated
+
+    year, month = map(int, min(time.strftime('%Y-%m'), dated[-1]).split('-'))
+    month -= months - 1
+    while month < 1:
+        month += 12
+        year -= 1
+
+    first = str(year) + '-' + str(month).zfill(2)
+    return undated + [i for i in dated if i >= first]
+
+
+# Partition file names of a snapshot
+def partition_file_path(tenant, version, key, kind='csv'):
+    return tenant['snapshots_path'] + version + '.' + (key or 'undated') + '.' + kind
+
+
+def snapshot_files(manifest):
+    files = []
+    for i in manifest['partitions'].values():
+        files.append(i['base'])
+        files.extend(i['deltas'])
+    return files
+
+
+# Version of the current snapshot
+def current_snapshot_version(tenant):
+    try:
+        with open(tenant['pointer_path'], 'r') as pointer_file:
+            return json.load(pointer_file)
+
+    except FileNotFoundError:
+        if not os.path.exists(tenant['file_path']):
+            raise
+
+    # a log uploaded before the snapshots becomes the first one, as one undated partition
+    with tenant['upload_lock']:
+        if os.path.exists(tenant['pointer_path']):
+            return current_snapshot_version(tenant)
+
+        version = new_snapshot_version()
+        partition = {'rows': 0, 'base': tenant['file_path'], 'deltas': []}
+        if os.path.exists(tenant['delta_file_path']):
+            partition['deltas'].append(tenant['delta_file_path'])
+
+        index = read_partition_index(tenant, version, '', partition)
+        partition['rows'] = len(index['rows'])
+        publish_snapshot(tenant, {'version': version, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'type': 'full',
+                                  'rows': partition['rows'], 'partitions': {'': partition}}, {'': index})
+        return version
+
+
+# Index a partition from its files
+def read_partition_index(tenant, version, key, partition):
+    if completed_moves_mmap:
+        store = MappedRows(partition['base'])
+        index = build_completed_moves_index(store.scan(), version, tenant['scac'], store, key)
+    else:
+        with open(partition['base'], 'r', encoding='utf-8') as eod_log_file:
+            reader = csv.reader(eod_log_file)
+            reader.__next__()
+            index = build_completed_moves_index(reader, version, tenant['scac'], partition=key)
+
+    for delta_file_path in partition['deltas']:
+        with open(delta_file_path, 'r', encoding='utf-8') as delta_file:
+            reader = csv.reader(delta_file)
+            reader.__next__()
+            index = merge_completed_moves_index(index, reader, version)[0]
+
+    return index
+
+
+# Keep a partition index in memory, the least recently used ones are dropped
+def cache_partition_index(tenant, partition, index):
+    cache_key = (partition['base'], *partition['deltas'])
+    index['files'] = cache_key
+
+    with tenant['partitions_lock']:
+        tenant['partitions'][cache_key] = index
+        tenant['partitions'].move_to_end(cache_key)
+        while len(tenant['partitions']) > completed_moves_partitions_cached:
+            tenant['partitions'].popitem(last=False)
+
+
+# Index of a partition of a snapshot, only read from its files when it isn't in memory
+def get_partition_index(tenant, version, key, partition):
+    cache_key = (partition['base'], *partition['deltas'])
+
+    with tenant['partitions_lock']:
+        index = tenant['partitions'].get(cache_key)
+        if index is not None:
+            tenant['partitions'].move_to_end(cache_key)
+
+    if index is None:
+        index = read_partition_index(tenant, version, key, partition)
+        cache_partition_index(tenant, partition, index)
+
+    return index
+
+
+# Move IDs of a partition without indexing it: the ones of its index when it is cached, otherwise the .ids files of
+# its files(a file written before them is read for its Move IDs only)
+def read_partition_move_ids(tenant, partition):
+    with tenant['partitions_lock']:
+        index = tenant['partitions'].get((partition['base'], *partition['deltas']))
+    if index is not None:
+        return index['move_ids']
+
+    move_ids = set()
+    for file_path in [partition['base']] + partition['deltas']:
+        if os.path.exists(file_path + '.ids'):
+            with open(file_path + '.ids', 'r', encoding='utf-8') as ids_file:
+                move_ids.update(i[:-1] for i in ids_file)
+        else:
+            with open(file_path, 'r', encoding='utf-8') as partition_file:
+                reader = csv.reader(partition_file)
+                reader.__next__()
+                move_ids.update(i[3] for i in reader if i)
+
+    return move_ids
+
+
+# Make a snapshot the current one. Its files are complete before the manifest and the manifest before the pointer,
+# so a reader only ever sees a whole snapshot. Readers still busy with the previous one keep it.
+# indexes - partition key -> index, of the partitions the upload has built
+def publish_snapshot(tenant, manifest, indexes):
+    os.makedirs(tenant['snapshots_path'], exist_ok=True)
+    write_json_atomically(tenant['snapshots_path'] + manifest['version'] + '.json', manifest)
+    for key, index in indexes.items():
+        cache_partition_index(tenant, manifest['partitions'][key], index)
+    write_json_atomically(tenant['pointer_path'], manifest['version'])
+    remove_old_snapshots(tenant)
+
+
+# Only the last completed_moves_snapshots_kept snapshots are kept on disk
+def remove_old_snapshots(tenant):
+    snapshots = list_snapshots(tenant)
+
+    kept_files = set()
+    for i in snapshots[:completed_moves_snapshots_kept]:
+        kept_files.update(snapshot_files(i))
+
+    for i in snapshots[completed_moves_snapshots_kept:]:
+        os.remove(tenant['snapshots_path'] + i['version'] + '.json')
+        for file_path in snapshot_files(i):
+            # a mapped file stays readable for whoever still has it open
+            if file_path not in kept_files and os.path.exists(file_path):
+                os.remove(file_path)
+                if os.path.exists(file_path + '.ids'):
+                    os.remove(file_path + '.ids')
+                kept_files.add(file_path)
+
+
+# Publish an upload replacing the whole log, every row is written to the file of its partition, indexed, counted and
+# loaded as it comes. Rows without the header's number of fields are skipped and counted.
+# Returns the statistics of the snapshot
+def publish_completed_moves_upload(tenant, rows):
+    with tenant['upload_lock']:
+        os.makedirs(tenant['snapshots_path'], exist_ok=True)
+        version = new_snapshot_version()
+        manifest = {'version': version, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'type': 'full', 'rows': 0,
+                    'skipped_rows': 0, 'partitions': {}}
+        files = {}
+        indexes = {}
+        stats = {}
+
+        try:
+            for row in rows:
+                if len(row) != len(completed_moves_header):
+                    manifest['skipped_rows'] += 1
+                    continue
+
+                key = partition_key(row)
+                if key not in files:
+                    files[key] = SnapshotFile(partition_file_path(tenant, version, key))
+                    # mapped rows are read from the file once it is complete
+                    indexes[key] = new_completed_moves_index(version, tenant['scac'], key,
+                                                             [] if completed_moves_mmap else None)
+                    stats[key] = new_completed_moves_stats()
+
+                files[key].write(row)
+                if not completed_moves_mmap:
+                    indexes[key]['rows'].append(row)
+                index_completed_move(indexes[key], len(files[key].offsets) - 2, row)
+                count_completed_move(stats[key], row, tenant['scac'])
+
+            for key, file in files.items():
+                file.close()
+                if completed_moves_mmap:
+                    indexes[key]['rows'] = MappedRows(file.file_path, file.offsets)
+                finish_completed_moves_index(indexes[key])
+
+                manifest['partitions'][key] = {'rows': len(indexes[key]['rows']), 'base': file.file_path,
+                                               'deltas': [],
+                                               'stats': count_duplicate_move_ids(stats[key], indexes[key])}
+                manifest['rows'] += len(indexes[key]['rows'])
+
+            # the database is committed before the pointer moves, an EOD reply cached under the new version is never
+            # checked against the rows of the previous one
+            if completed_moves_in_db:
+                load_completed_moves_to_db(tenant, indexes)
+                manifest['db_version'] = version
+
+        except Exception:
+            for file in files.values():
+                file.discard()
+            raise
+
+        publish_snapshot(tenant, manifest, indexes)
+
+    return snapshot_stats(tenant, manifest)
+
+
+# Partition without the row of each of the Move IDs(rows a merge moved to another partition), written as a new
+# base file of the snapshot. Returns the partition, its index and its file
+def remove_from_partition(tenant, version, key, partition, index, move_ids):
+    removed = {move_id_position(index['move_ids'][i]) for i in move_ids}
+    file = SnapshotFile(partition_file_path(tenant, version, key))
+    rows = []
+    try:
+        for position, row in enumerate(index['rows']):
+            if position not in removed:
+                file.write(row)
+                rows.append(row)
+        file.close()
+
+    except Exception:
+        file.discard()
+        raise
+
+    if completed_moves_mmap:
+        new_index = build_completed_moves_index(rows, version, tenant['scac'], [], key)
+        new_index['rows'] = MappedRows(file.file_path, file.offsets)
+    else:
+        new_index = build_completed_moves_index(rows, version, tenant['scac'], partition=key)
+
+    stats = partition.get('stats') or read_partition_stats(tenant, index['version'], key, partition)
+    stats = dict(stats, statuses=dict(stats['statuses']), shifts=dict(stats['shifts']))
+    for position in removed:
+        count_completed_move(stats, index['rows'][position], tenant['scac'], -1)
+
+    partition = {'rows': len(rows), 'base': file.file_path, 'deltas': [],
+                 'stats': count_duplicate_move_ids(stats, new_index)}
+    return partition, new_index, file
+
+
+# Publish a "merge" upload, the new snapshot is the current one plus a delta file with the rows of the upload for
+# every partition it touches(a month it brings in gets its own base file). Only those rows are merged into a copy of
+# the partition indexes, nothing else is written or parsed again, the statistics only recount the changed rows.
+# A row moved to another month(its Month/Year Helper changed) replaces the Move ID's row in the partition it was in,
+# the Move IDs new to their partition are looked up in the Move IDs of the others for it(no other month is parsed).
+# Rows without the header's number of fields are skipped and counted.
+# Returns the number of added and updated rows and the statistics of the snapshot
+def merge_into_completed_moves_log(tenant, rows):
+    with tenant['upload_lock']:
+        parent = read_snapshot_manifest(tenant, current_snapshot_version(tenant))
+        version = new_snapshot_version()
+        manifest = dict(parent, version=version, created=time.strftime('%Y-%m-%d %H:%M:%S'), type='merge',
+                        skipped_rows=0, partitions=dict(parent['partitions']))
+
+        # a merge upload is small, it is grouped by partition first
+        grouped = {}
+        for row in rows:
+            if len(row) != len(completed_moves_header):
+                manifest['skipped_rows'] += 1
+                continue
+            grouped.setdefault(partition_key(row), []).append(row)
+
+        files = []
+        parent_indexes = {}
+        indexes = {}
+        changed = {}
+        # partition key -> Move IDs whose row moved to another partition
+        moved = {}
+        added = 0
+        try:
+            new_move_ids = {}
+            for key, partition_rows in grouped.items():
+                partition = parent['partitions'].get(key)
+                if partition:
+                    parent_indexes[key] = get_partition_index(tenant, parent['version'], key, partition)
+                for row in partition_rows:
+                    if not partition or row[3] not in parent_indexes[key]['move_ids']:
+                        new_move_ids[row[3]] = key
+
+            # only the Move IDs of the other partitions are read, a partition is indexed when a row moved out of it
+            if new_move_ids:
+                for key, partition in parent['partitions'].items():
+                    partition_move_ids = (parent_indexes[key]['move_ids'] if key in parent_indexes
+                                          else read_partition_move_ids(tenant, partition))
+                    move_ids = [i for i, new_key in new_move_ids.items()
+                                if new_key != key and i in partition_move_ids]
+                    if not move_ids:
+                        continue
+
+                    index = parent_indexes.get(key) or get_partition_index(tenant, parent['version'], key, partition)
+                    moved[key] = move_ids
+                    manifest['partitions'][key], indexes[key], file = remove_from_partition(
+                        tenant, version, key, partition, index, move_ids)
+                    files.append(file)
+                    parent_indexes[key] = indexes[key]
+                    # a partition left empty is dropped, unless the upload has rows for it
+                    if not manifest['partitions'][key]['rows'] and key not in grouped:
+                        del manifest['partitions'][key]
+                        del indexes[key]
+
+            for key, partition_rows in grouped.items():
+                partition = manifest['partitions'].get(key)
+                file = SnapshotFile(partition_file_path(tenant, version, key, 'delta.csv' if partition else 'csv'))
+                files.append(file)
+                for row in partition_rows:
+                    file.write(row)
+                file.close()
+
+                if partition:
+                    parent_index = parent_indexes[key]
+                    index, changed[key] = merge_completed_moves_index(parent_index, partition_rows, version)
+                    stats = partition.get('stats') or read_partition_stats(tenant, parent['version'], key, partition)
+                    stats = dict(stats, statuses=dict(stats['statuses']), shifts=dict(stats['shifts']))
+                    for position, row in changed[key].items():
+                        if position < len(parent_index['rows']):
+                            count_completed_move(stats, parent_index['rows'][position], tenant['scac'], -1)
+                        else:
+                            added += 1
+                        count_completed_move(stats, row, tenant['scac'])
+                    manifest['partitions'][key] = {'rows': len(index['rows']), 'base': partition['base'],
+                                                   'deltas': partition['deltas'] + [file.file_path], 'stats': stats}
+                else:
+                    if completed_moves_mmap:
+                        index = build_completed_moves_index(partition_rows, version, tenant['scac'], [], key)
+                        index['rows'] = MappedRows(file.file_path, file.offsets)
+                    else:
+                        index = build_completed_moves_index(partition_rows, version, tenant['scac'], partition=key)
+                    changed[key] = dict(enumerate(partition_rows))
+                    added += len(partition_rows)
+                    stats = new_completed_moves_stats()
+                    for row in partition_rows:
+                        count_completed_move(stats, row, tenant['scac'])
+                    manifest['partitions'][key] = {'rows': len(index['rows']), 'base': file.file_path, 'deltas': [],
+                                                   'stats': count_duplicate_move_ids(stats, index)}
+
+                indexes[key] = index
+
+            # a moved row is an updated one
+            added -= len({i for move_ids in moved.values() for i in move_ids})
+            manifest['rows'] = sum(i['rows'] for i in manifest['partitions'].values())
+            # committed before the pointer moves, as in publish_completed_moves_upload(). A table that doesn't hold
+            # the parent snapshot(filled before a merge in files only, or never) waits for the next full upload
+            manifest.pop('db_version', None)
+            if completed_moves_in_db and parent.get('db_version') == parent['version']:
+                merge_completed_moves_to_db(tenant, changed, moved)
+                manifest['db_version'] = version
+
+        except Exception:
+            for file in files:
+                file.discard()
+            raise
+
+        publish_snapshot(tenant, manifest, indexes)
+
+    return added, sum(len(i) for i in changed.values()) - added, snapshot_stats(tenant, manifest)
+
+
+# Chunks of a streamed download, at most max_size bytes are accepted
+def limit_chunks(chunks, max_size):
+    size = 0
+
+    for chunk in chunks:
+        size += len(chunk)
+        if size > max_size:
+            raise ValueError('File bigger than ' + str(max_size) + ' bytes')
+        yield chunk
+
+
+# gzip members decompressed as they stream in
+def gunzip_chunks(chunks):
+    decompressor = zlib.decompressobj(31)
+
+    for chunk in chunks:
+        while chunk:
+            yield decompressor.decompress(chunk)
+            # a new member starts right after the end of the previous one
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+            else:
+                chunk = b''
+
+
+# First file of a zip archive decompressed as it streams in, read from its local file header
+# so the archive never has to be saved to look up its central directory
+def unzip_chunks(chunks):
+    chunks = iter(chunks)
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= 30:
+            break
+
+    if len(buffer) < 30:
+        raise ValueError('Zip file is cut short')
+
+    signature, version, flags, method, mod_time, mod_date, crc, compressed_size, size, name_length, extra_length = \
+        struct.unpack('<4sHHHHHIIIHH', buffer[:30])
+    if flags & 1:
+        raise ValueError('Encrypted zip files are not supported')
+    if method not in (0, 8) or (method == 0 and flags & 8):
+        raise ValueError('Unsupported zip compression')
+
+    data_start = 30 + name_length + extra_length
+    while len(buffer) < data_start:
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise ValueError('Zip file is cut short')
+        buffer += chunk
+
+    chunks = itertools.chain([buffer[data_start:]], chunks)
+
+    # stored
+    if method == 0:
+        for chunk in chunks:
+            yield chunk[:compressed_size]
+            compressed_size -= len(chunk)
+            if compressed_size <= 0:
+                return
+        return
+
+    # deflated, the deflate stream knows where it ends
+    decompressor = zlib.decompressobj(-15)
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+        if decompressor.eof:
+            return
+
+
+# Unpack gzip and zip files on the fly, anything else passes as it is
+def unpack_chunks(chunks):
+    chunks = iter(chunks)
+    first = b''
+    for chunk in chunks:
+        first += chunk
+        if len(first) >= 4:
+            break
+    chunks = itertools.chain([first], chunks)
+
+    if first[:2] == b'\x1f\x8b':
+        return gunzip_chunks(chunks)
+    if first[:4] == b'PK\x03\x04':
+        return unzip_chunks(chunks)
+    return chunks
+
+
+# Lines of streamed chunks, decoded chunk by chunk
+def iter_lines(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    rest = ''
+
+    for chunk in chunks:
+        lines = (rest + decoder.decode(chunk)).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield line + '\n'
+
+    rest += decoder.decode(b'', final=True)
+    if rest:
+        yield rest
+
+
+# Ingest the csv lines of an upload: header check, then parse, write, index, count and publish in one pass.
+# Returns False if the file isn't a completed moves log, (added, updated, statistics) for a merge,
+# the statistics otherwise
+def ingest_completed_moves_upload(tenant, lines, merge=False):
+    reader = csv.reader(lines)
+
+    if next(reader, None) != completed_moves_header:
+        return False
+
+    rows = (i for i in reader if i)
+    if merge:
+        return merge_into_completed_moves_log(tenant, rows)
+
+    return publish_completed_moves_upload(tenant, rows)
+
+
+# Uploads waiting for the ingestion worker: (tenant name, telegram_id, file_id, kind, date)
+completed_moves_upload_queue = queue.Queue()
+completed_moves_upload_worker = None
+completed_moves_upload_worker_lock = threading.Lock()
+
+
+# Download, ingest and publish an upload, the user is told how it went once the new snapshot is the current one.
+# A dispatch list(kind 'eod') is checked against the log instead, the one of a batch day(kind 'batch') is added to
+# the admin's batch
+def process_completed_moves_upload(tenant, telegram_id, file_id, kind, date=''):
+    try:
+        # streamed straight into the ingestion, the file is never held in memory or saved as it was sent
+        web_file_info = bot.get_file(file_id)
+        with download_session.get(f'https://api.telegram.org/file/bot{token}/{web_file_info.file_path}',
+                                  stream=True, timeout=download_timeout) as web_file:
+            web_file.raise_for_status()
+            chunks = limit_chunks(web_file.iter_content(chunk_size=64 * 1024), completed_moves_max_upload_size)
+            # gzip/zip files are unpacked on the fly, nothing unpacked is saved
+            chunks = limit_chunks(unpack_chunks(chunks), completed_moves_max_unpacked_size)
+
+            # a dispatch list to check, the log stays as it is
+            if kind == 'eod':
+                records = read_dispatch_file(iter_lines(chunks))
+                send_eod_replies(telegram_id, EOD_check_file(tenant, records,
+                                                             as_of=get_as_of_snapshot(tenant, telegram_id),
+                                                             months=get_search_scope(telegram_id)))
+                return
+
+            if kind == 'batch':
+                records = read_dispatch_file(iter_lines(chunks))
+                bot.send_message(telegram_id, add_to_eod_batch(telegram_id, date, records))
+                return
+
+            result = ingest_completed_moves_upload(tenant, iter_lines(chunks), kind == 'merge')
+
+        if not result:
+            bot.send_message(telegram_id, 'File error, Completed moves log has not been updated')
+            return
+
+        if kind == 'merge':
+            added, updated, stats = result
+            bot.send_message(telegram_id, 'File merged succesfully\n'
+                                          'Added: ' + str(added) + '\n'
+                                          'Updated: ' + str(updated) + '\n\n' +
+                                          completed_moves_stats_report(stats))
+            return
+
+        bot.send_message(telegram_id, 'File updated succesfully\n\n' + completed_moves_stats_report(result))
+
+    except Exception as e:
+        print('Error uploading and saving the file: ' + str(e))
+        bot.send_message(telegram_id, 'Error uploading the file, please try again later or contact support')
+
+
+# Uploads are ingested one at a time off the webhook, queries keep using the current snapshot until the new one
+# is published
+def run_completed_moves_upload_worker():
+    while True:
+        tenant_name, telegram_id, file_id, kind, date = completed_moves_upload_queue.get()
+        try:
+            with app.app_context():
+                process_completed_moves_upload(tenants[tenant_name], telegram_id, file_id, kind, date)
+        finally:
+            completed_moves_upload_queue.task_done()
+
+
+# Queue an upload, kind - 'full', 'merge', 'eod'(a dispatch list to check) or 'batch'(the dispatch list of the date
+# for the admin's batch). The worker thread is started with the first one(a thread started on import wouldn't survive
+# a forking server). Returns the number of uploads ahead of it
+def queue_completed_moves_upload(tenant, telegram_id, file_id, kind, date=''):
+    global completed_moves_upload_worker
+
+    with completed_moves_upload_worker_lock:
+        if completed_moves_upload_worker is None or not completed_moves_upload_worker.is_alive():
+            completed_moves_upload_worker = threading.Thread(target=run_completed_moves_upload_worker, daemon=True)
+            completed_moves_upload_worker.start()
+
+    ahead = completed_moves_upload_queue.unfinished_tasks
+    completed_moves_upload_queue.put((tenant['name'], telegram_id, file_id, kind, date))
+    return ahead
+
+
+# completed_moves table record of a verified row
+def completed_move_record(tenant, position, row, partition):
+    container = row[4].upper()
+    return {'tenant': tenant['name'], 'id': position, 'month': row[0], 'year_helper': row[1], 'driver_name': row[2],
+            'move_id': row[3], 'container_number': row[4], 'inbound_or_outbound': row[5], 'load_status': row[6],
+            'shift_to_move': row[7], 'status': row[8], 'created_date': row[9], 'partition': partition,
+            'container_key': container, 'container_serial': container[4:], 'container_reversed': container[::-1]}
+
+
+# completed_move_last_4s table records of the completed_moves records
+def completed_move_last_4_records(tenant, records):
+    return [{'tenant': tenant['name'], 'id': i['id'], 'last_4': key}
+            for i in records for key in last_4_keys(i['move_id'], tenant['scac'])]
+
+
+# Replace the tenant's rows of the completed_moves table with the verified rows of the partition indexes
+# (partition key -> index), oldest partition first, in a single transaction(bulk insert in chunks)
+def load_completed_moves_to_db(tenant, indexes, chunk_size=5000):
+    table = CompletedMove.__table__
+    last_4_table = CompletedMoveLast4.__table__
+    rows = ((key, row) for key in sorted(indexes) for row in indexes[key]['rows'])
+    records = (completed_move_record(tenant, position, row, key) for position, (key, row) in enumerate(rows))
+
+    try:
+        db.session.execute(table.delete().where(table.c.tenant == tenant['name']))
+        db.session.execute(last_4_table.delete().where(last_4_table.c.tenant == tenant['name']))
+        chunk = list(itertools.islice(records, chunk_size))
+        while chunk:
+            db.session.execute(table.insert(), chunk)
+            last_4_records = completed_move_last_4_records(tenant, chunk)
+            if last_4_records:
+                db.session.execute(last_4_table.insert(), last_4_records)
+            chunk = list(itertools.islice(records, chunk_size))
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+# Merge the changed rows(partition key -> {position: row}) into the completed_moves table in a single transaction,
+# the same way merge_completed_moves_index() does: the last row of a known Move ID within the partition is replaced,
+# its duplicates stay, a new one goes after the last row. The row of the moved Move IDs(partition key -> Move IDs)
+# is removed from the partition they were in
+def merge_completed_moves_to_db(tenant, changed, moved=None):
+    table = CompletedMove.__table__
+    last_4_table = CompletedMoveLast4.__table__
+
+    try:
+        for key, move_ids in (moved or {}).items():
+            ids = [i for move_id, i in db.session.query(CompletedMove.move_id, db.func.max(CompletedMove.id))
+                   .filter_by(tenant=tenant['name'], partition=key).filter(CompletedMove.move_id.in_(move_ids))
+                   .group_by(CompletedMove.move_id)]
+            db.session.execute(table.delete().where(db.and_(table.c.tenant == tenant['name'], table.c.id.in_(ids))))
+            db.session.execute(last_4_table.delete().where(db.and_(last_4_table.c.tenant == tenant['name'],
+                                                                   last_4_table.c.id.in_(ids))))
+
+        next_id = (db.session.query(db.func.max(CompletedMove.id)).filter_by(tenant=tenant['name']).scalar() or 0) + 1
+        records = []
+        for key, rows in changed.items():
+            last_ids = dict(db.session.query(CompletedMove.move_id, db.func.max(CompletedMove.id))
+                            .filter_by(tenant=tenant['name'], partition=key)
+                            .filter(CompletedMove.move_id.in_([i[3] for i in rows.values()]))
+                            .group_by(CompletedMove.move_id))
+            for row in rows.values():
+                if row[3] in last_ids:
+                    record = completed_move_record(tenant, last_ids[row[3]], row, key)
+                    db.session.execute(table.update().where(db.and_(table.c.tenant == tenant['name'],
+                                                                    table.c.id == record.pop('id'))), record)
+                else:
+                    records.append(completed_move_record(tenant, next_id + len(records), row, key))
+
+        if records:
+            db.session.execute(table.insert(), records)
+            last_4_records = completed_move_last_4_records(tenant, records)
+            if last_4_records:
+                db.session.execute(last_4_table.insert(), last_4_records)
+        db.session.commit()
+
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+# Rows of a column starting with one of the keys, as a range(the way the partition indexes bisect them),
+# so the column's index is used and nothing in the keys is a wildcard
+def starts_with_any(column, keys):
+    return [db.and_(column >= i, column < i + '\uffff') for i in keys]
+
+
+# Indexes of only the rows the given terms can match, queried from the completed_moves table(only the given
+# partitions, None - all of them), one per partition, oldest first. EOD and search run unchanged on them, as they have
+# the same shape as the partition indexes. Every kind of term has its own indexed lookup: Move IDs, last 4s and
+# containers(start, serial or end of the number)
+def get_completed_moves_indexes_from_db(tenant, move_ids=(), last_4s=(), container_terms=(), partitions=None):
+    filters = []
+    if move_ids:
+        filters.append(CompletedMove.move_id.in_(move_ids))
+    if last_4s:
+        filters.append(CompletedMove.id.in_(db.session.query(CompletedMoveLast4.id)
+                                            .filter_by(tenant=tenant['name'])
+                                            .filter(CompletedMoveLast4.last_4.in_(last_4s))))
+    if container_terms:
+        filters += starts_with_any(CompletedMove.container_key, container_terms)
+        filters += starts_with_any(CompletedMove.container_serial, container_terms)
+        filters += starts_with_any(CompletedMove.container_reversed, [i[::-1] for i in container_terms])
+
+    grouped = {}
+    if filters:
+        query = CompletedMove.query.filter_by(tenant=tenant['name']).filter(db.or_(*filters))
+        if partitions is not None:
+            query = query.filter(CompletedMove.partition.in_(partitions))
+        for i in query.order_by(CompletedMove.id):
+            grouped.setdefault(i.partition, []).append(i.to_row())
+
+    return [build_completed_moves_index(grouped[key], None, tenant['scac'], partition=key) for key in sorted(grouped)]
+
+
+# Indexes to run the search terms against, oldest partition first: the partitions in the scope of the last months
+# (0 - all), or only the rows they can match from the database. The database is only read while it holds the current
+# snapshot(see db_version of the manifest)
+def get_search_indexes(tenant, terms, with_containers=True, as_of=None, months=search_scope_default):
+    if not completed_moves_in_db or as_of:
+        return get_completed_moves_indexes(tenant, as_of, months)
+
+    manifest = read_snapshot_manifest(tenant, current_snapshot_version(tenant))
+    if manifest.get('db_version') != manifest['version']:
+        return get_completed_moves_indexes(tenant, manifest['version'], months)
+
+    return get_completed_moves_indexes_from_db(tenant, move_ids=terms,
+                                               last_4s=[i for i in terms if len(i) == 4],
+                                               container_terms=[i.upper() for i in terms] if with_containers else (),
+                                               partitions=scope_partitions(manifest['partitions'], months))
+
+
+# Get the partition indexes of the current snapshot, or of an earlier one(as_of version), in the scope of the last
+# months(0 - all) or only the given partition keys, oldest first. Only the partitions that aren't cached are parsed
+# (first message after a restart, an upload handled by another worker process, an earlier snapshot or an older month)
+def get_completed_moves_indexes(tenant, as_of=None, months=search_scope_default, partitions=None):
+    manifest = read_snapshot_manifest(tenant, as_of or current_snapshot_version(tenant))
+
+    if partitions is None:
+        partitions = scope_partitions(manifest['partitions'], months)
+    else:
+        partitions = [i for i in sorted(partitions) if i in manifest['partitions']]
+
+    return [get_partition_index(tenant, manifest['version'], key, manifest['partitions'][key]) for key in partitions]
+
+
+# Months a user's EOD and search look at
+def get_search_scope(telegram_id):
+    return search_scopes.get(telegram_id, search_scope_default)
+
+
+def search_scope_label(months):
+    return 'all months' if not months else 'last ' + str(months) + ' months'
+
+
+# Row of the log with the Move ID(the newest partition wins) and whether the partition has the Move ID more than once
+def find_log_row(indexes, move_id):
+    for index in reversed(indexes):
+        positions = index['move_ids'].get(move_id)
+        if positions is not None:
+            return index['rows'][move_id_position(positions)], type(positions) is tuple
+
+    return None, False
+
+
+# Snapshot an admin is looking at, forgotten once the snapshot is removed
+def get_as_of_snapshot(tenant, telegram_id):
+    version = as_of_snapshots.get(telegram_id)
+
+    if version and not os.path.exists(tenant['snapshots_path'] + version + '.json'):
+        as_of_snapshots.pop(telegram_id, None)
+        return None
+
+    return version
+
+
+# Memory taken by the rows of the cached partitions(the default scope of the current snapshot is read first)
+# compared to keeping them as plain lists
+def completed_moves_memory_report(tenant):
+    get_completed_moves_indexes(tenant)
+    with tenant['partitions_lock']:
+        indexes = list(tenant['partitions'].values())
+
+    report = 'Completed moves log memory(' + tenant['name'] + '):\n'
+    total_store_size = total_list_size = total_index_size = 0
+    for index in indexes:
+        rows = index['rows']
+        store_size = rows.memory_size()
+        list_size = rows_list_memory_size(rows)
+        index_size = index_memory_size(index)
+        total_store_size += store_size
+        total_list_size += list_size
+        total_index_size += index_size
+        report += (index['partition'] or 'Undated') + ': ' + str(len(rows)) + ' rows, ' + type(rows).__name__ + \
+            ' ' + str(round(store_size / 1024 / 1024, 1)) + ' MB, index ' + \
+            str(round(index_size / 1024 / 1024, 1)) + ' MB' + (' with near matches' if index.get('near') else '') + \
+            '\n'
+
+    return report + \
+        'Cached partitions: ' + str(len(indexes)) + '\n' \
+        'Total: ' + str(round(total_store_size / 1024 / 1024, 1)) + ' MB\n' \
+        'As lists: ' + str(round(total_list_size / 1024 / 1024, 1)) + ' MB\n' \
+        'Saved: ' + str(round(100 - total_store_size / max(total_list_size, 1) * 100)) + '%\n' \
+        'Indexes: ' + str(round(total_index_size / 1024 / 1024, 1)) + ' MB'
+
+
 # ======================================================================================================================
 # Utility functions
 
@@ -101,8 +1639,13 @@ def build_menu(position_in_menu, user=None, is_admin=False):
     elif position_in_menu == 1:
         button = types.KeyboardButton('Current mode: "EOD"')
         markup.row(button)
+        button = types.KeyboardButton('Check')
+        markup.row(button)
         button = types.KeyboardButton('Change to search')
         markup.row(button)
+        button = types.KeyboardButton('Scope: ' + search_scope_label(get_search_scope(user.id) if user else
+                                                                     search_scope_default))
+        markup.row(button)
         button = types.KeyboardButton('Back to main menu')
         markup.row(button)
         message = 'Click the "Mode" button for more info'
@@ -111,6 +1654,9 @@ def build_menu(position_in_menu, user=None, is_admin=False):
         markup.row(button)
         button = types.KeyboardButton('Change to EOD')
         markup.row(button)
+        button = types.KeyboardButton('Scope: ' + search_scope_label(get_search_scope(user.id) if user else
+                                                                     search_scope_default))
+        markup.row(button)
         button = types.KeyboardButton('Back to main menu')
         markup.row(button)
         message = 'Click the "Mode" button for more info'
@@ -137,142 +1683,672 @@ def is_bot_admin(telegram_id):
     return True if telegram_id in admin_bot_list else False
 
 
-# Search function
-def search_for_an_ID_or_row(text, return_dictionary=False, match_last_4=False):
-    matched = []
-    file_path = 'temp/completed_moves_verified.csv'
+# Tenant of the user, the first one of the config when the user has none(or one no longer in the config)
+def get_tenant(user):
+    return tenants.get(user.tenant) or next(iter(tenants.values()))
+
+
+# Positions of the rows whose container number is, starts with, has a serial starting with or ends with the text
+def search_containers(index, text):
+    text = text.upper()
+    positions = set()
+
+    if text in index['containers']:
+        positions.update(index['containers'][text])
+
+    for keys, containers, key in ((*index['container_prefixes'], text),
+                                  (*index['container_serials'], text),
+                                  (*index['container_suffixes'], text[::-1])):
+        start = bisect.bisect_left(keys, key)
+        end = bisect.bisect_left(keys, key + '\uffff', start)
+        for i in containers[start:end]:
+            positions.update(index['containers'][i])
+
+    return positions
+
+
+# Positions of the rows matching a search term, in log order
+def search_positions(index, text, match_last_4=False):
+    positions = set()
+
+    if match_last_4 or len(text) == 4:
+        positions.update(index['last_4'].get(text, []))
+
+    if not match_last_4:
+        if text in index['move_ids']:
+            positions.update(move_id_positions(index['move_ids'][text]))
 
-    with open(file_path, 'r') as eod_log_file:
-        reader = csv.reader(eod_log_file)
-        reader.__next__()
+        positions.update(search_containers(index, text))
 
-        for i in reader:
-            if match_last_4:
-                if re.search(f'{text + scac}', i[3]):
-                    matched.append(i)
-            elif re.search(f'{text + scac}', i[3]) and len(text) == 4:
-                matched.append(i)
-            elif i[4] and re.search(f'{text}', i[4]):
-                matched.append(i)
-            elif i[3] == text:
-                matched.append(i)
+    return sorted(positions)
 
-    if not matched:
+
+# Cursors of the matched rows of an index for a search result: (tenant name, version, partition key, files, position),
+# the partition index is read again through get_partition_index() for the page shown(no index is kept with the result).
+# The rows of an index from the database(not a partition of files) are kept as they are
+def search_cursors(tenant, index, positions):
+    if 'files' not in index:
+        return [index['rows'][i] for i in positions]
+
+    return [(tenant['name'], index['version'], index['partition'], index['files'], i) for i in positions]
+
+
+# Row of a search cursor
+def read_search_cursor(cursor):
+    if isinstance(cursor, list):
+        return cursor
+
+    tenant_name, version, key, files, position = cursor
+    partition = {'base': files[0], 'deltas': list(files[1:])}
+    return get_partition_index(tenants[tenant_name], version, key, partition)['rows'][position]
+
+
+# Search function, returns the matched rows with return_dictionary, otherwise the search result(see
+# send_search_result) with a cursor per matched row(see search_cursors), the rows are only read for the page shown
+def search_for_an_ID_or_row(tenant, text, return_dictionary=False, match_last_4=False, as_of=None,
+                            months=search_scope_default):
+    indexes = get_search_indexes(tenant, [text], with_containers=not match_last_4, as_of=as_of, months=months)
+    matched = [(index, search_positions(index, text, match_last_4)) for index in indexes]
+
+    if not any(positions for index, positions in matched):
         return False
 
     if return_dictionary:
-        return matched
+        return [index['rows'][i] for index, positions in matched for i in positions]
 
-    return_messages = []
-    return_message = 'Matched Rows:'
-    for i in matched:
-        reply = '\n'
-        for j in i:
-            reply += j + ' '
-        if len(reply) > 4096:
-            reply = "row to long? report this to admin"
-        if len(return_message) + len(reply) > 4096:
-            return_messages.append(return_message)
-            return_message = ''
-        return_message += reply[:-1]
-    return_messages.append(return_message)
+    return 'Matched Rows:', [i for index, positions in matched for i in search_cursors(tenant, index, positions)]
 
-    return return_messages
 
+# Batch search, one term per row(Move ID, last 4 or container), every term is looked up in the same index
+# and the matched rows are grouped under the term
+def search_for_a_list(tenant, text, as_of=None, months=search_scope_default):
+    terms = list(dict.fromkeys(i.strip() for i in text.split('\n') if i.strip()))
+    indexes = get_search_indexes(tenant, terms, as_of=as_of, months=months)
 
-# EOD logic check function
-# gets a message from a user and returns a reply based on input
-def EOD_logic_check(message):
+    items = []
+    for term in terms:
+        matched = [i for index in indexes for i in search_cursors(tenant, index, search_positions(index, term))]
+        items.append('\n' + term + (':' if matched else ' - Not found'))
+        items.extend(matched)
+
+    return 'Matched Rows:', items
+
+
+# Search results, a page at a time: result id -> {telegram_id, title, items - a text or a cursor(see search_cursors)
+# per line}, most recently used last. Pages are turned with the inline buttons under the results message,
+# nothing is searched again
+search_results = OrderedDict()
+search_results_lock = threading.Lock()
+search_result_ids = itertools.count(1)
+
+
+def get_search_result(result_id):
+    with search_results_lock:
+        result = search_results.get(result_id)
+        if result is not None:
+            search_results.move_to_end(result_id)
+
+    return result
+
+
+# Text and inline keyboard of a page of a search result
+def search_result_page(result_id, result, page):
+    pages = max(1, -(-len(result['items']) // search_page_size))
+    page = min(max(page, 0), pages - 1)
+
+    text = result['title'] + ('' if pages == 1 else ' page ' + str(page + 1) + ' of ' + str(pages))
+    for i in result['items'][page * search_page_size:(page + 1) * search_page_size]:
+        line = i if isinstance(i, str) else ' '.join(read_search_cursor(i))
+        if len(line) > 4096:
+            line = 'row to long? report this to admin'
+        text += '\n' + line
+
+    if pages == 1:
+        return text[:4096], None
+
+    reply_markup = types.InlineKeyboardMarkup()
+    buttons = []
+    if page > 0:
+        buttons.append(types.InlineKeyboardButton('< Previous',
+                                                  callback_data='search:' + result_id + ':' + str(page - 1)))
+    if page < pages - 1:
+        buttons.append(types.InlineKeyboardButton('Next >', callback_data='search:' + result_id + ':' + str(page + 1)))
+    reply_markup.row(*buttons)
+
+    return text[:4096], reply_markup
+
+
+# Keep a search result(title, items) and send its first page
+def send_search_result(telegram_id, result):
+    title, items = result
+    result_id = str(next(search_result_ids))
+    result = {'telegram_id': telegram_id, 'title': title, 'items': items}
+
+    with search_results_lock:
+        search_results[result_id] = result
+        while len(search_results) > search_results_cached:
+            search_results.popitem(last=False)
+
+    text, reply_markup = search_result_page(result_id, result, 0)
+    bot.send_message(telegram_id, text, reply_markup=reply_markup)
+
+
+# Replies of the last EOD checks, most recently used last, keyed by
+# (tenant name, snapshot version, scope months, current month, hash of the normalized records).
+# An upload publishes a new version, so the replies of the previous log are never returned again
+eod_results = OrderedDict()
+eod_results_lock = threading.Lock()
+
+
+def get_eod_result(key):
+    with eod_results_lock:
+        result = eod_results.get(key)
+        if result is not None:
+            eod_results.move_to_end(key)
+            return list(result)
+
+    return None
+
+
+def cache_eod_result(key, result):
+    with eod_results_lock:
+        eod_results[key] = tuple(result)
+        eod_results.move_to_end(key)
+        while len(eod_results) > eod_results_cached:
+            eod_results.popitem(last=False)
+
+    return result
+
+
+# EOD pastes longer than one message arrive as several messages, a user's messages are gathered and checked together
+# once none has come for eod_session_debounce seconds, or when the "Check" button is clicked.
+# telegram id -> {fragments - the texts in order, tenant, as_of, months, timer}
+eod_sessions = {}
+eod_sessions_lock = threading.Lock()
+
+
+def add_to_eod_session(tenant, telegram_id, text, as_of=None, months=search_scope_default):
+    with eod_sessions_lock:
+        session = eod_sessions.get(telegram_id)
+        if session:
+            session['timer'].cancel()
+        else:
+            session = eod_sessions[telegram_id] = {'fragments': [], 'tenant': tenant, 'as_of': as_of, 'months': months}
+
+        session['fragments'].append(text)
+        session['timer'] = threading.Timer(eod_session_debounce, run_eod_session, [telegram_id])
+        session['timer'].daemon = True
+        session['timer'].start()
+
+
+# Check the gathered paste of a user and send the reply, False if there was nothing to check
+def run_eod_session(telegram_id):
+    with eod_sessions_lock:
+        session = eod_sessions.pop(telegram_id, None)
+        if session:
+            session['timer'].cancel()
+
+    if not session:
+        return False
+
+    # messages are split at row ends, every fragment is whole rows
+    lines = itertools.chain.from_iterable(i.split('\n') for i in session['fragments'])
+    with app.app_context():
+        if session['fragments'][0].lstrip().lower().startswith('reconcile'):
+            send_eod_replies(telegram_id, reconcile_dispatch_list(session['tenant'], lines, as_of=session['as_of']))
+        else:
+            send_eod_replies(telegram_id, EOD_logic_check(session['tenant'], lines, as_of=session['as_of'],
+                                                          months=session['months']))
+
+    return True
+
+
+# Rows of the EOD issues document, one per move with issues
+def eod_issue_rows(issued_moves, move_id_counts):
+    for reply, issue, record, log_row, log_duplicate, suggestion in issued_moves:
+        duplicate = []
+        if move_id_counts[record[0]] > 1:
+            duplicate.append('EOD list')
+        if log_duplicate:
+            duplicate.append('Yusen log')
+        yield record[0], issue, record[1], log_row[4] if log_row else '', ', '.join(duplicate), suggestion
+
+
+# csv document of the EOD issues, as (file name, content)
+# rows - (Move ID, issue, our container, Yusen container, duplicate, suggestion) per move with issues
+def eod_issues_document(rows):
+    document = io.StringIO()
+    writer = csv.writer(document)
+    writer.writerow(['Move ID', 'Issue', 'Our container', 'Yusen container', 'Duplicate', 'Suggestion'])
+    writer.writerows(rows)
+
+    return 'EOD_issues_' + time.strftime('%Y-%m-%d_%H%M') + '.csv', document.getvalue().encode('utf-8')
+
+
+# issues - the issue of every move with issues
+def eod_issues_summary(moves_checked, issues):
+    issues = Counter('Last 4' if i.startswith('Last 4') else i for i in issues)
+    summary = 'Moves checked: ' + str(moves_checked) + '\n' \
+              'Moves with issues: ' + str(sum(issues.values())) + ', see the attached file'
+
+    for issue, count in issues.most_common():
+        summary += '\n  ' + issue + ': ' + str(count)
+
+    return summary
+
+
+# "YYYY-MM-DD" of a M/D/YYYY(the log's Created date) or YYYY-MM-DD date, '' if it isn't one
+def normalize_date(text):
+    match = re.fullmatch(r'(\d{1,2})/(\d{1,2})/(\d{4})', text)
+    if match:
+        month, day, year = match.groups()
+    else:
+        match = re.fullmatch(r'(\d{4})-(\d{1,2})-(\d{1,2})', text)
+        if not match:
+            return ''
+        year, month, day = match.groups()
+
+    if not (1 <= int(month) <= 12 and 1 <= int(day) <= 31):
+        return ''
+
+    return year + '-' + month.zfill(2) + '-' + day.zfill(2)
+
+
+# Two way reconciliation of dispatched moves with the log for a day(date as YYYY-MM-DD, and shift, '' - both).
+# Both differences are set differences of Move IDs: the moves of the day in the log and not dispatched, and the
+# dispatched moves(Move ID -> record) the log doesn't have on that day(with where the log has them instead, if it does).
+# Returns the number of moves of the day in the log and (Move ID, side, container, shift, Created date) per difference
+def reconcile_day(tenant, date, shift, dispatched, as_of=None):
+    # a move can be logged in the month before or after its Created date, undated rows are always in
+    # (see scope_partitions)
+    year, month = int(date[:4]), int(date[5:7])
+    partitions = [''] + [str(year + (month + i - 1) // 12) + '-' + str((month + i - 1) % 12 + 1).zfill(2)
+                         for i in (-1, 0, 1)]
+    indexes = get_completed_moves_indexes(tenant, as_of, partitions=partitions)
+
+    logged = {}
+    for index in indexes:
+        for key, positions in index['dates'].items():
+            if normalize_date(key) != date:
+                continue
+            for position in positions:
+                row = index['rows'][position]
+                if not shift or row[7] == shift:
+                    logged[row[3]] = row
+
+    differences = []
+    for i in sorted(logged.keys() - dispatched.keys()):
+        row = logged[i]
+        differences.append((i, 'Yusen only', row[4], row[7], row[9]))
+    for i in sorted(dispatched.keys() - logged.keys()):
+        row = find_log_row(indexes, i)[0]
+        differences.append((i, 'Dispatch only', dispatched[i][1], row[7] if row else '', row[9] if row else ''))
+
+    return len(logged), differences
+
+
+# Reconciliation of an EOD paste, first row "reconcile DATE [AM/PM]"
+def reconcile_dispatch_list(tenant, lines, as_of=None):
     try:
-        eod_log = {}
-        file_path = 'temp/completed_moves_verified.csv'
+        lines = iter(lines)
+        command = next(lines).split()
+        date = normalize_date(command[1]) if len(command) > 1 else ''
+        shift = command[2].upper() if len(command) > 2 else ''
+        if not date or shift not in ('', 'AM', 'PM'):
+            return ['First row should be: reconcile DATE(M/D/YYYY) and optionally the shift(AM/PM)']
+
+        dispatched = {}
+        for record in tokenize_dispatch_list(lines):
+            dispatched[record[0]] = record
+
+        logged, differences = reconcile_day(tenant, date, shift, dispatched, as_of)
+        yusen_only = [i for i in differences if i[1] == 'Yusen only']
+        dispatch_only = [i for i in differences if i[1] == 'Dispatch only']
+
+        title = 'Reconciliation of ' + command[1] + (' ' + shift if shift else '') + ':\n' \
+                'Yusen moves: ' + str(logged) + ', dispatched moves: ' + str(len(dispatched)) + '\n' \
+                'Yusen moves we did not dispatch: ' + str(len(yusen_only)) + '\n' \
+                'Dispatched moves Yusen does not have that day: ' + str(len(dispatch_only))
+        if not differences:
+            return [title + '\n\nEverything is correct!!!']
+
+        if eod_document_threshold and len(differences) > eod_document_threshold:
+            document = io.StringIO()
+            writer = csv.writer(document)
+            writer.writerow(['Move ID', 'Side', 'Container', 'Shift', 'Created date'])
+            writer.writerows(differences)
+            return [title, ('Reconciliation_' + date + (('_' + shift) if shift else '') + '.csv',
+                            document.getvalue().encode('utf-8'))]
 
-        with open(file_path, 'r') as eod_log_file:
-            reader = csv.reader(eod_log_file)
-            reader.__next__()
-            for i in reader:
-                eod_log.update({i[3]: i})
+        return_messages = []
+        return_message = title
+        for i in differences:
+            reply = '\n' + i[0] + ' - ' + i[1] + ' ' + i[2]
+            if i[1] == 'Dispatch only' and i[4]:
+                reply += ' (Yusen has it on ' + i[4] + ' ' + i[3] + ')'
+            if len(return_message) + len(reply) > 4096:
+                return_messages.append(return_message)
+                return_message = ''
+            return_message += reply
+        return_messages.append(return_message)
 
-        raw_list = message.split('\n')
-        dispatch_list = []
+        return return_messages
+
+    except Exception as e:
+        print('An error has occurred: ' + str(e))
+        return ['An error occurred, please report this to the manager with the message you sent to the bot']
+
+
+# Admin batch reconciliation of several days(catching up after a long weekend): "batch" with a date range opens a
+# batch, the dispatch file of every day is uploaded(the date in its caption or file name, several files of a day add
+# up) and "batch run" reconciles the days in a process pool, one day per task.
+# telegram id -> {tenant, as_of, dates - YYYY-MM-DD of every day of the range, files - date -> records}
+eod_batches = {}
+eod_batches_lock = threading.Lock()
+
+
+# Every date from first to last(YYYY-MM-DD), [] if last is before first
+def date_range(first, last):
+    first, last = datetime.date.fromisoformat(first), datetime.date.fromisoformat(last)
+    return [str(first + datetime.timedelta(days=i)) for i in range((last - first).days + 1)]
+
+
+# Date(YYYY-MM-DD) of a batch dispatch file from its caption, or else its file name(M-D-YYYY, M.D.YYYY, M_D_YYYY or
+# YYYY-MM-DD), '' if neither has one
+def dispatch_file_date(caption, file_name):
+    for text in (caption or '', file_name or ''):
+        match = re.search(r'\d{4}-\d{1,2}-\d{1,2}', text)
+        if match:
+            date = normalize_date(match.group())
+        else:
+            match = re.search(r'(\d{1,2})[/._-](\d{1,2})[/._-](\d{4})', text)
+            date = normalize_date('/'.join(match.groups())) if match else ''
+        if date:
+            return date
+
+    return ''
+
+
+def open_eod_batch(tenant, telegram_id, first, last, as_of=None):
+    with eod_batches_lock:
+        eod_batches[telegram_id] = {'tenant': tenant, 'as_of': as_of, 'dates': date_range(first, last), 'files': {}}
+
+
+# Add the records of an uploaded dispatch file to the admin's batch, returns the reply
+def add_to_eod_batch(telegram_id, date, records):
+    with eod_batches_lock:
+        batch = eod_batches.get(telegram_id)
+        if not batch:
+            return 'No batch is open, start one with "batch" and the date range'
+        if date not in batch['dates']:
+            return 'The file is not for a day of the batch(' + batch['dates'][0] + ' - ' + batch['dates'][-1] + \
+                '), put its date in the caption'
+
+        batch['files'].setdefault(date, []).extend(records)
+        return date + ': ' + str(len(records)) + ' moves added\n' \
+            'Days with a file: ' + str(len(batch['files'])) + ' of ' + str(len(batch['dates'])) + \
+            ', send "batch" with "run" in the second row to reconcile them'
+
+
+# A forked batch process keeps the partition cache of the bot(shared copy-on-write) but gets new locks, a lock held
+# by another thread of the bot at the fork would never be released in the process
+def init_eod_batch_process():
+    for tenant in tenants.values():
+        tenant['partitions_lock'] = threading.Lock()
+        tenant['upload_lock'] = threading.RLock()
+
+
+# Reconciliation of a day of a batch, runs in a batch process(only the counts and differences are sent back)
+def reconcile_batch_day(tenant_name, date, records, as_of):
+    dispatched = {}
+    for record in records:
+        dispatched[record[0]] = record
 
-        # check for spaces
-        while raw_list:
-            if re.search(r'\S', raw_list[0]):
-                dispatch_list.append(raw_list[0])
-            raw_list.pop(0)
+    logged, differences = reconcile_day(tenants[tenant_name], date, '', dispatched, as_of)
+    return date, logged, len(dispatched), differences
 
-        for i in range(len(dispatch_list)):
-            current_row = dispatch_list[i - 1].split(' ')
-            dispatch_list[i - 1] = []
-            for j in current_row:
-                if j:
-                    dispatch_list[i - 1].append(j)
 
-        duplicate_list = {}
+# Reconcile the days of the admin's batch that have a file, every day is a task of a process pool(eod_batch_processes,
+# one per CPU core by default) and the reports are merged into one summary and one document
+def run_eod_batch(telegram_id):
+    with eod_batches_lock:
+        batch = eod_batches.pop(telegram_id, None)
 
-        for i in dispatch_list:
-            if duplicate_list.get(i[0], 'N/F') == 'N/F':
-                duplicate_list.update({i[0]: False})
+    try:
+        days = [i for i in batch['dates'] if i in batch['files']]
+        arguments = ([batch['tenant']['name']] * len(days), days, [batch['files'][i] for i in days],
+                     [batch['as_of']] * len(days))
+
+        processes = min(eod_batch_processes or os.cpu_count() or 1, len(days))
+        if processes > 1:
+            with concurrent.futures.ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context('fork'),
+                                                        initializer=init_eod_batch_process) as pool:
+                results = list(pool.map(reconcile_batch_day, *arguments))
+        else:
+            results = list(map(reconcile_batch_day, *arguments))
+
+        send_eod_replies(telegram_id, eod_batch_report(batch['dates'], results))
+
+    except Exception as e:
+        print('An error has occurred: ' + str(e))
+        bot.send_message(telegram_id, 'An error occurred while reconciling the batch, please try again')
+
+
+# Summary of a batch and the differences of all of its days in one document
+def eod_batch_report(dates, results):
+    results = {i[0]: i for i in results}
+
+    summary = 'Batch reconciliation ' + dates[0] + ' - ' + dates[-1] + ':'
+    totals = [0, 0, 0, 0]
+    document = io.StringIO()
+    writer = csv.writer(document)
+    writer.writerow(['Date', 'Move ID', 'Side', 'Container', 'Shift', 'Created date'])
+
+    for date in dates:
+        if date not in results:
+            summary += '\n' + date + ': no dispatch file'
+            continue
+
+        date, logged, dispatched, differences = results[date]
+        yusen_only = sum(1 for i in differences if i[1] == 'Yusen only')
+        counts = [logged, dispatched, yusen_only, len(differences) - yusen_only]
+        totals = [a + b for a, b in zip(totals, counts)]
+        summary += '\n' + date + ': Yusen ' + str(counts[0]) + ', dispatched ' + str(counts[1]) + \
+            ', Yusen only ' + str(counts[2]) + ', dispatch only ' + str(counts[3])
+        writer.writerows((date,) + i for i in differences)
+
+    summary += '\n\nTotal: Yusen ' + str(totals[0]) + ', dispatched ' + str(totals[1]) + \
+        ', Yusen only ' + str(totals[2]) + ', dispatch only ' + str(totals[3])
+    if not totals[2] and not totals[3]:
+        return [summary + '\n\nEverything is correct!!!']
+
+    return [summary, ('Reconciliation_' + dates[0] + '_' + dates[-1] + '.csv', document.getvalue().encode('utf-8'))]
+
+
+# Send EOD replies, a reply is a message or a (file name, content) document
+def send_eod_replies(telegram_id, replies):
+    for i in replies:
+        if isinstance(i, str):
+            bot.send_message(telegram_id, i)
+            continue
+
+        document = io.BytesIO(i[1])
+        document.name = i[0]
+        bot.send_document(telegram_id, document)
+
+
+# Records of an EOD paste, (Move ID, container number, Move Type) per row, in one pass over the rows.
+# Blank rows are skipped, a missing field is ''
+def tokenize_dispatch_list(lines):
+    for line in lines:
+        fields = line.split()
+        if fields:
+            yield fields[0], fields[1] if len(fields) > 1 else '', fields[2] if len(fields) > 2 else ''
+
+
+def suggestion_list(values, shown=3):
+    return ', '.join(values[:shown]) + (' and ' + str(len(values) - shown) + ' more' if len(values) > shown else '')
+
+
+# What a move with issues was likely meant to be, '' if nothing is close:
+# Not found/Wrong scac - Move IDs of the log one typo away(completed_moves_near_matches), otherwise the moves with our
+# container(or one a typo away)
+# Container does not match - whether ours fails the ISO 6346 check digit and is a typo away from Yusen's
+def suggest_eod_correction(indexes, issue, record, log_container):
+    if issue in ('Not found', 'Wrong scac'):
+        if completed_moves_near_matches:
+            move_ids = list(dict.fromkeys(i for index in indexes
+                                          for i in near_keys(get_near_keys(index)['move_ids'], index['move_ids'],
+                                                             record[0])))
+            if move_ids:
+                return 'did you mean ' + suggestion_list(move_ids)
+
+        container = record[1].upper()
+        if not container:
+            return ''
+        containers = [container]
+        if completed_moves_near_matches and not any(container in index['containers'] for index in indexes):
+            containers = list(dict.fromkeys(i for index in indexes
+                                            for i in near_keys(get_near_keys(index)['containers'],
+                                                               index['containers'], container)))
+        move_ids = list(dict.fromkeys(index['rows'][j][3] for index in indexes for i in containers
+                                      for j in index['containers'].get(i, [])))
+        if move_ids:
+            return ('container is on ' if containers == [container] else 'a container like it is on ') + \
+                suggestion_list(move_ids)
+
+    elif issue == 'Container does not match':
+        suggestion = []
+        check_digit = container_check_digit(record[1].upper())
+        if check_digit is not None and len(record[1]) == 11 and record[1][-1] != check_digit:
+            suggestion.append('our container fails the check digit')
+        if log_container and one_typo_apart(record[1].upper(), log_container.upper()):
+            suggestion.append('one typo away from Yusen\'s')
+        return ', '.join(suggestion)
+
+    return ''
+
+
+# Issues of the EOD records(Move ID, container number, Move Type) against the log indexes of the last months(0 - all),
+# (reply, issue, record, log_row, log_duplicate, suggestion) per move with issues
+def check_dispatch_list(tenant, dispatch_list, move_id_counts, indexes, months=0):
+    issued_moves = []
+
+    for i in dispatch_list:
+        # [Move_ID, container number, Move Type]
+        log_row, log_duplicate = find_log_row(indexes, i[0])
+
+        # if move_id is 4 digits only:
+        if len(i[0]) == 4 and not re.match(r'^0-9', i[0]):
+            search_res = [index['rows'][j][3] for index in indexes for j in index['last_4'].get(i[0], [])]
+            reply = i[0] + ' - Matched ID\'s:  '
+            if search_res:
+                for j in search_res:
+                    reply += ' ' + j + ','
+                reply = reply[:-1]
             else:
-                duplicate_list.update({i[0]: True})
+                reply = i[0] + ' - no match'
+            issued_moves.append((reply, 'Last 4 - ' + (' '.join(search_res) if search_res else 'no match'), i,
+                                 log_row, log_duplicate, ''))
+
+        # correct scac check
+        elif not i[0][-4:] == tenant['scac']:
+            reply = i[0] + ' - Wrong scac'
+            if move_id_counts[i[0]] > 1:
+                reply += ', Duplicate ID'
+            suggestion = suggest_eod_correction(indexes, 'Wrong scac', i, log_row[4] if log_row else '')
+            if suggestion:
+                reply += ', ' + suggestion
+            issued_moves.append((reply, 'Wrong scac', i, log_row, log_duplicate, suggestion))
+
+        # if container not found
+        elif log_row is None:
+            reply = i[0] + ' - Not Found' + ('' if not months else ' in the ' + search_scope_label(months))
+            if move_id_counts[i[0]] > 1:
+                reply += ', Duplicate ID'
+            suggestion = suggest_eod_correction(indexes, 'Not found', i, '')
+            if suggestion:
+                reply += ', ' + suggestion
+            if months:
+                reply += ', the "Scope" button widens the search'
+            issued_moves.append((reply, 'Not found', i, log_row, log_duplicate, suggestion))
+
+        # all elif's bellow are found
+
+        # if a bobtail(extra check if duplicate):
+        elif log_row[6] == 'Bobtail':
+            if move_id_counts[i[0]] > 1:
+                reply = i[0] + ' - duplicate Move ID'
+                if log_duplicate:
+                    reply += ', duplicate in the Yusen log'
+                issued_moves.append((reply, 'Duplicate Move ID', i, log_row, log_duplicate, ''))
+            elif log_duplicate:
+                reply = i[0] + ' - duplicate Move ID in the Yusen log'
+                issued_moves.append((reply, 'Duplicate Move ID', i, log_row, log_duplicate, ''))
+
+        # container does not match
+        elif not log_row[4] == i[1]:
+            reply = i[0] + ' - container does not match'
+            if move_id_counts[i[0]] > 1:
+                reply += ', duplicate'
+            if log_duplicate:
+                reply += ', duplicate in the Yusen log'
+            reply += '\n  Us: ' + i[1] + '\n  Yusen: ' + log_row[4]
+            suggestion = suggest_eod_correction(indexes, 'Container does not match', i, log_row[4])
+            if suggestion:
+                reply += '\n  (' + suggestion + ')'
+            issued_moves.append((reply, 'Container does not match', i, log_row, log_duplicate, suggestion))
+
+        # container match, but duplicate
+        elif log_row[4] == i[1] and move_id_counts[i[0]] > 1:
+            reply = i[0] + ' - container match, duplicate move ID'
+            if log_duplicate:
+                reply += ', duplicate in the Yusen log'
+            issued_moves.append((reply, 'Duplicate Move ID', i, log_row, log_duplicate, ''))
+
+        # container match, but the Yusen log has the move more than once
+        elif log_duplicate:
+            reply = i[0] + ' - container match, duplicate move ID in the Yusen log'
+            issued_moves.append((reply, 'Duplicate Move ID', i, log_row, log_duplicate, ''))
+
+    return issued_moves
 
-        issued_moves = []
-        broken_rows = []
 
-        for i in dispatch_list:
-            # [Move_ID, container number, Move Type]
-
-            # if move_id is 4 digits only:
-            if len(i[0]) == 4 and not re.match(r'^0-9', i[0]):
-                search_res = search_for_an_ID_or_row(i[0], return_dictionary=True, match_last_4=True)
-                reply = i[0] + ' - Matched ID\'s:  '
-                if search_res:
-                    for j in search_res:
-                        reply += ' ' + j[3] + ','
-                    reply = reply[:-1]
-                else:
-                    reply = i[0] + ' - no match'
-                issued_moves.append(reply)
-
-            # correct scac check
-            elif not i[0][-4:] == scac:
-                reply = i[0] + ' - Wrong scac'
-                if duplicate_list.get(i[0]):
-                    reply += ', Duplicate ID'
-                issued_moves.append(reply)
-
-            # if container not found
-            elif eod_log.get(i[0], 'N/F') == 'N/F':
-                reply = i[0] + ' - Not Found'
-                if duplicate_list.get(i[0]):
-                    reply += ', Duplicate ID'
-                issued_moves.append(reply)
-
-            # all elif's bellow are found
-
-            # if a bobtail(extra check if duplicate):
-            elif eod_log.get(i[0])[6] == 'Bobtail':
-                if duplicate_list.get(i[0]):
-                    reply = i[0] + ' - duplicate Move ID'
-                    issued_moves.append(reply)
-
-            # container does not match
-            elif not eod_log.get(i[0])[4] == i[1]:
-                reply = i[0] + ' - container does not match'
-                if duplicate_list.get(i[0]):
-                    reply += ', duplicate'
-                reply += '\n  Us: ' + i[1] + '\n  Yusen: ' + eod_log.get(i[0])[4]
-                issued_moves.append(reply)
-
-            # container match, but duplicate
-            elif eod_log.get(i[0])[4] == i[1] and duplicate_list.get(i[0]):
-                reply = i[0] + ' - container match, duplicate move ID'
-                issued_moves.append(reply)
+# EOD logic check function
+# gets a message from a user and returns a reply based on input
+# message - the pasted text, or any iterable of its rows(a file)
+def EOD_logic_check(tenant, message, as_of=None, months=search_scope_default):
+    try:
+        dispatch_list = []
+        move_id_counts = Counter()
+
+        for record in tokenize_dispatch_list(message.split('\n') if isinstance(message, str) else message):
+            dispatch_list.append(record)
+            move_id_counts[record[0]] += 1
+
+        # the same paste(whitespace aside) against the same log gets the same reply
+        records_hash = hashlib.sha1('\n'.join(' '.join(i) for i in dispatch_list).encode('utf-8')).hexdigest()
+        result_key = (tenant['name'], as_of or current_snapshot_version(tenant), months, time.strftime('%Y-%m'),
+                      records_hash)
+        result = get_eod_result(result_key)
+        if result:
+            return result
+
+        indexes = get_search_indexes(tenant, list(move_id_counts), with_containers=False, as_of=as_of,
+                                     months=months)
+
+        issued_moves = check_dispatch_list(tenant, dispatch_list, move_id_counts, indexes, months)
+        broken_rows = []
 
         # Build reply:
         if not (broken_rows or issued_moves):
-            return ['Everything is correct!!!']
+            return cache_eod_result(result_key, ['Everything is correct!!!'])
+
+        # too many issues for messages, they go in a csv document with a summary
+        if eod_document_threshold and len(issued_moves) > eod_document_threshold:
+            summary = eod_issues_summary(len(dispatch_list), [i[1] for i in issued_moves])
+            return cache_eod_result(result_key, [summary, eod_issues_document(eod_issue_rows(issued_moves,
+                                                                                             move_id_counts))])
 
         return_messages = []
         return_message = 'Broken rows:'
@@ -291,7 +2367,7 @@ def EOD_logic_check(message):
         return_message = 'Moves with Issues:'
         if issued_moves:
             for i in issued_moves:
-                reply = '\n' + i
+                reply = '\n' + i[0]
                 if len(reply) > 4096:
                     print('Error: ' + reply)
                     reply = '\nrow to long? report this to admin'
@@ -304,15 +2380,143 @@ def EOD_logic_check(message):
             return_messages.append('Everything else is correct!!!')
 
         if return_messages:
-            return return_messages
+            return cache_eod_result(result_key, return_messages)
 
     except Exception as e:
         print('An error has occurred: ' + str(e))
         return ['An error occurred, please report this to the manager with the message you sent to the bot']
 
 
+# Records of an uploaded EOD dispatch list, a csv file(Move ID, container number, Move Type) or rows separated by
+# spaces like a paste. A header row(no digits in its Move ID) is skipped, a missing field is ''
+def read_dispatch_file(lines):
+    records = []
+
+    for row in csv.reader(lines):
+        fields = [i.strip() for i in row]
+        if len(fields) == 1:
+            fields = fields[0].split()
+        if not fields or not fields[0] or (not records and not re.search(r'[0-9]', fields[0])):
+            continue
+        records.append((fields[0], fields[1] if len(fields) > 1 else '', fields[2] if len(fields) > 2 else ''))
+
+    return records
+
+
+# Values of a column of the log rows at the positions, taken from the CompactRows columns as they are stored
+def log_column(rows, column, positions):
+    if not isinstance(rows, CompactRows):
+        return [rows[i][column] for i in positions]
+
+    if column in rows.encoded_columns:
+        return numpy.array(rows.values[column], dtype=object)[numpy.asarray(rows.columns[column])[positions]]
+
+    return numpy.array(rows.columns[column], dtype=object)[positions]
+
+
+# The log as columns, one row per Move ID: the container, load status and duplicate flag of the row find_log_row
+# returns for it(the newest partition wins)
+def log_frame(indexes):
+    frames = []
+    for index in indexes:
+        move_ids = index['move_ids']
+        positions = numpy.fromiter((move_id_position(i) for i in move_ids.values()), dtype=numpy.int64,
+                                   count=len(move_ids))
+        frames.append(pandas.DataFrame({
+            'move_id': list(move_ids),
+            'log_container': log_column(index['rows'], 4, positions),
+            'load_status': log_column(index['rows'], 6, positions),
+            'log_duplicate': numpy.fromiter((type(i) is tuple for i in move_ids.values()), dtype=bool,
+                                            count=len(move_ids)),
+        }))
+
+    if not frames:
+        return pandas.DataFrame(columns=['move_id', 'log_container', 'load_status', 'log_duplicate'])
+
+    return pandas.concat(frames, ignore_index=True).drop_duplicates('move_id', keep='last')
+
+
+# check_dispatch_list over columns: the records are joined with the log on the Move ID(a hash join) and every issue
+# is a mask over the joined rows. Returns the issue of every move with issues and the issues document rows
+def check_dispatch_frame(tenant, records, indexes):
+    dispatch = pandas.DataFrame.from_records(records, columns=['move_id', 'container', 'move_type'])
+    dispatch['duplicate'] = dispatch.duplicated('move_id', keep=False)
+    moves = dispatch.merge(log_frame(indexes), on='move_id', how='left', indicator=True)
+
+    move_ids = moves['move_id']
+    container = moves['container'].to_numpy(dtype=object)
+    log_container = moves['log_container'].fillna('').to_numpy(dtype=object)
+    duplicate = moves['duplicate'].to_numpy(dtype=bool)
+    log_duplicate = moves['log_duplicate'].fillna(False).to_numpy(dtype=bool)
+    found = (moves['_merge'] == 'both').to_numpy()
+
+    # same order as the checks of check_dispatch_list, the first one that applies is the issue
+    last_4 = (move_ids.str.len() == 4).to_numpy(copy=True)
+    last_4[[i for i in numpy.flatnonzero(last_4) if re.match(r'^0-9', move_ids[i])]] = False
+    wrong_scac = ~last_4 & (move_ids.str[-4:] != tenant['scac']).to_numpy()
+    not_found = ~last_4 & ~wrong_scac & ~found
+    bobtail = ~last_4 & ~wrong_scac & found & (moves['load_status'] == 'Bobtail').to_numpy()
+    matched = ~last_4 & ~wrong_scac & found & ~bobtail
+    mismatch = matched & (container != log_container)
+    any_duplicate = duplicate | log_duplicate
+
+    issue = numpy.select([last_4, wrong_scac, not_found, bobtail & any_duplicate, mismatch, matched & any_duplicate],
+                         ['Last 4', 'Wrong scac', 'Not found', 'Duplicate Move ID', 'Container does not match',
+                          'Duplicate Move ID'], default='').astype(object)
+
+    # few rows, the last 4 matches are looked up one by one
+    for i in numpy.flatnonzero(last_4):
+        search_res = [index['rows'][j][3] for index in indexes for j in index['last_4'].get(move_ids[i], [])]
+        issue[i] = 'Last 4 - ' + (' '.join(search_res) if search_res else 'no match')
+
+    duplicate_text = numpy.where(duplicate & log_duplicate, 'EOD list, Yusen log',
+                                 numpy.where(duplicate, 'EOD list', numpy.where(log_duplicate, 'Yusen log', '')))
+
+    move_ids = move_ids.to_numpy(dtype=object)
+    suggestion = numpy.full(len(moves), '', dtype=object)
+    for i in numpy.flatnonzero(wrong_scac | not_found | mismatch):
+        suggestion[i] = suggest_eod_correction(indexes, issue[i], (move_ids[i], container[i]), log_container[i])
+
+    issued = issue != ''
+    rows = zip(move_ids[issued].tolist(), issue[issued].tolist(), container[issued].tolist(),
+               log_container[issued].tolist(), duplicate_text[issued].tolist(), suggestion[issued].tolist())
+    return issue[issued].tolist(), rows
+
+
+# EOD check of an uploaded dispatch list(month end), replies with a summary and the issues document.
+# Checked over columns with pandas, without it the records go through the checks of a paste
+def EOD_check_file(tenant, records, as_of=None, months=search_scope_default):
+    try:
+        if not records:
+            return ['No moves found in the file']
+
+        records_hash = hashlib.sha1('\n'.join(' '.join(i) for i in records).encode('utf-8')).hexdigest()
+        result_key = (tenant['name'], as_of or current_snapshot_version(tenant), months, time.strftime('%Y-%m'),
+                      'file', records_hash)
+        result = get_eod_result(result_key)
+        if result:
+            return result
+
+        indexes = get_completed_moves_indexes(tenant, as_of, months)
+        if pandas is not None:
+            issues, rows = check_dispatch_frame(tenant, records, indexes)
+        else:
+            move_id_counts = Counter(i[0] for i in records)
+            issued_moves = check_dispatch_list(tenant, records, move_id_counts, indexes, months)
+            issues, rows = [i[1] for i in issued_moves], eod_issue_rows(issued_moves, move_id_counts)
+
+        if not issues:
+            return cache_eod_result(result_key, ['Moves checked: ' + str(len(records)) + '\nEverything is correct!!!'])
+
+        return cache_eod_result(result_key, [eod_issues_summary(len(records), issues), eod_issues_document(rows)])
+
+    except Exception as e:
+        print('An error has occurred: ' + str(e))
+        return ['An error occurred, please report this to the manager with the file you sent to the bot']
+
+
 # Sort logic in 1 spot
-def split_sort_current_work(message):
+def split_sort_current_work(tenant, message):
     try:
         text = message.split('\n')
         locations = {'Taylor Way', 'Sumner 1', 'Sumner 2'}
@@ -329,7 +2533,7 @@ def split_sort_current_work(message):
             if not i:
                 pass
 
-            elif (len(i) > 4 and re.search(rf'[0-9]{scac}', i)) or len(text) == 1:
+            elif (len(i) > 4 and re.search(rf'[0-9]{tenant["scac"]}', i)) or len(text) == 1:
 
                 if not current_move_id:
                     current_move_id = i
@@ -409,8 +2613,8 @@ def split_sort_current_work(message):
 
 
 # Request to SmartSheets to obtain FormToken
-def get_form_token():
-    url = "https://app.smartsheet.com/b/form/f6aacf211b2a4f10ae3bda2cfc6bce2a"
+def get_form_token(tenant):
+    url = "https://app.smartsheet.com/b/form/" + tenant['smartsheet_form']
     r = requests.request("GET", url)
 
     if r.status_code != 200:
@@ -428,8 +2632,8 @@ def get_form_token():
 
 
 # Request to SmartSheets to submit a bobtail
-def submit_bobtail(customer, shift, origin, destination, driver_name, comment):
-    form_token = get_form_token()
+def submit_bobtail(tenant, customer, shift, origin, destination, driver_name, comment):
+    form_token = get_form_token(tenant)
 
     if not form_token:
         print('No FormToken error')
@@ -437,10 +2641,10 @@ def submit_bobtail(customer, shift, origin, destination, driver_name, comment):
 
     try:
 
-        url = "https://forms.smartsheet.com/api/submit/f6aacf211b2a4f10ae3bda2cfc6bce2a"
+        url = "https://forms.smartsheet.com/api/submit/" + tenant['smartsheet_form']
 
         payload = {
-            'data': '{"kqkzAPq":{"type":"STRING","value":"'+scac+'"},"zXlGWn2":{"type":"STRING","value":"Bobtail"},"EkrG8Ql":{"type":"STRING","value":"'+customer+'"},"Jn6Zrgm":{"type":"STRING","value":"'+shift+'"},"7AgLY0G":{"type":"STRING","value":"'+origin+'"},"11eEO6J":{"type":"STRING","value":"'+destination+'"},"0kNKDaw":{"type":"STRING","value":"'+driver_name+'"},"7k6aRle":{"type":"STRING","value":"Completed"},"Yqd3MgE":{"type":"STRING","value":"'+comment+'"},"EMAIL_RECEIPT":{"type":"STRING","value":""}}'
+            'data': '{"kqkzAPq":{"type":"STRING","value":"'+tenant['scac']+'"},"zXlGWn2":{"type":"STRING","value":"Bobtail"},"EkrG8Ql":{"type":"STRING","value":"'+customer+'"},"Jn6Zrgm":{"type":"STRING","value":"'+shift+'"},"7AgLY0G":{"type":"STRING","value":"'+origin+'"},"11eEO6J":{"type":"STRING","value":"'+destination+'"},"0kNKDaw":{"type":"STRING","value":"'+driver_name+'"},"7k6aRle":{"type":"STRING","value":"Completed"},"Yqd3MgE":{"type":"STRING","value":"'+comment+'"},"EMAIL_RECEIPT":{"type":"STRING","value":""}}'
         }
 
         headers = {
@@ -527,7 +2731,7 @@ def bobtail_filter_and_submit(text, user):
         status, customer, shift, origin, destination, driver_name, comment = check_row(row, user)
         if not status:
             result.append(row)
-        elif not submit_bobtail(customer, shift, origin, destination, driver_name, comment) == 200:
+        elif not submit_bobtail(get_tenant(user), customer, shift, origin, destination, driver_name, comment) == 200:
             result.append(row)
 
     return_messages = []
@@ -600,6 +2804,27 @@ def start_command(m):
     bot.send_message(m.from_user.id, 'Menu has been reset', reply_markup=reply_markup)
 
 
+# Pages of a search result, the results message is edited in place
+@bot.callback_query_handler(func=lambda call: (call.data or '').startswith('search:'))
+def search_page_callback(call):
+    command, result_id, page = call.data.split(':')
+    result = get_search_result(result_id)
+
+    if not result or result['telegram_id'] != call.from_user.id:
+        bot.answer_callback_query(call.id, 'These results are no longer available, please search again')
+        return
+
+    try:
+        text, reply_markup = search_result_page(result_id, result, int(page))
+    # the files of the snapshot searched have been removed since
+    except OSError:
+        bot.answer_callback_query(call.id, 'These results are no longer available, please search again')
+        return
+
+    bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=reply_markup)
+    bot.answer_callback_query(call.id)
+
+
 # /test command
 @bot.message_handler(commands=['test'])
 def test_command(m):
@@ -622,6 +2847,31 @@ def test_command(m):
     bot.send_message(m.from_user.id, reply)
 
 
+# /stats - statistics of the completed moves log snapshot in use, counted when it was uploaded
+@bot.message_handler(commands=['stats'])
+def stats_command(m):
+    user = Users.query.filter_by(id=m.from_user.id).first()
+
+    if not user or user.position_in_menu < 0:
+        return
+
+    try:
+        tenant = get_tenant(user)
+        if not completed_moves_log_exists(tenant):
+            bot.send_message(m.from_user.id, 'No completed moves log has been uploaded yet')
+            return
+
+        manifest = read_snapshot_manifest(tenant, get_as_of_snapshot(tenant, m.from_user.id) or
+                                          current_snapshot_version(tenant))
+        bot.send_message(m.from_user.id, 'Completed moves log statistics(' + manifest['created'] + ' ' +
+                         manifest['type'] + ' upload):\n' +
+                         completed_moves_stats_report(snapshot_stats(tenant, manifest)))
+
+    except Exception as e:
+        print('An error has occurred: ' + str(e))
+        bot.send_message(m.from_user.id, 'An error occurred, please report this to the manager')
+
+
 # /help
 @bot.message_handler(commands=['help'])
 def help_command(m):
@@ -652,13 +2902,19 @@ def help_command(m):
             message = 'Admin features:\n' \
               'add [users_telegram_id]\n' \
               'remove [users_telegram_id]\n' \
-              'list - list of user id\'s\n'
+              'list - list of user id\'s\n' \
+              'memory - completed moves log memory report\n' \
+              'snapshots - list of the completed moves log snapshots\n' \
+              'asof [snapshot number] - EOD and search on an earlier snapshot, without a number back to the current\n' \
+              'tenant [users_telegram_id] [tenant name] - move a user to a tenant(' + ', '.join(tenants) + ')\n' \
+              'batch [first day] [last day] - reconcile the dispatch files of several days, ' \
+              'batch [run] once they are uploaded, batch [cancel] to drop them\n'
 
         bot.send_message(m.from_user.id, message, reply_markup=reply_markup)
         return
 
     if user.position_in_menu == 1:
-        message, reply_markup = build_menu(1)
+        message, reply_markup = build_menu(1, user=user)
         message = 'Current mode is EOD, the system tries to match yur report moves with the completed moves log you upload in advance\n' \
                   'For more info click the current mode button\n\n' \
                   'To change mode click the "Change to search"'
@@ -666,7 +2922,7 @@ def help_command(m):
         return
 
     if user.position_in_menu == 2:
-        message, reply_markup = build_menu(2)
+        message, reply_markup = build_menu(2, user=user)
         message = 'Current mode is search. click the current mode button on how to use this mode\n\n' \
                   'To change mode click the "Change to EOD"'
         bot.send_message(m.from_user.id, message, reply_markup=reply_markup)
@@ -718,7 +2974,7 @@ def messages(m):
 
     if user.position_in_menu == 0:
         if m.text == 'EOD':
-            message, reply_markup = build_menu(1)
+            message, reply_markup = build_menu(1, user=user)
             user.position_in_menu = 1
             db.session.commit()
             bot.send_message(m.from_user.id, message, reply_markup=reply_markup)
@@ -755,11 +3011,88 @@ def messages(m):
 
             r = 'list of users:'
             for i in user_list:
-                r += '\n' + str(i.id) + ' ' + i.name + ', pim: ' + str(i.position_in_menu)
+                r += '\n' + str(i.id) + ' ' + i.name + ', pim: ' + str(i.position_in_menu) + \
+                     ', tenant: ' + get_tenant(i)['name']
+
+            bot.send_message(m.from_user.id, r)
+            return
+
+        if text[0] == 'memory':
+            bot.send_message(m.from_user.id, completed_moves_memory_report(get_tenant(user)))
+            return
+
+        if text[0] == 'snapshots':
+            snapshots = list_snapshots(get_tenant(user))
+            if not snapshots:
+                bot.send_message(m.from_user.id, 'No completed moves log has been uploaded yet')
+                return
+
+            as_of = get_as_of_snapshot(get_tenant(user), m.from_user.id) or snapshots[0]['version']
+            r = 'Snapshots(newest first):'
+            for number, i in enumerate(snapshots, 1):
+                r += '\n' + str(number) + '. ' + i['created'] + ' ' + i['type'] + ', ' + str(i['rows']) + ' rows'
+                if i['version'] == as_of:
+                    r += ' <- in use'
 
             bot.send_message(m.from_user.id, r)
             return
 
+        if text[0] == 'asof':
+            if len(text) < 2 or not text[1].strip():
+                as_of_snapshots.pop(m.from_user.id, None)
+                bot.send_message(m.from_user.id, 'Back to the current snapshot')
+                return
+
+            snapshots = list_snapshots(get_tenant(user))
+            number = int(text[1])
+            if not 0 < number <= len(snapshots):
+                bot.send_message(m.from_user.id, 'Snapshot not found')
+                return
+
+            as_of_snapshots[m.from_user.id] = snapshots[number - 1]['version']
+            bot.send_message(m.from_user.id, 'EOD and search now use the snapshot of ' +
+                             snapshots[number - 1]['created'])
+            return
+
+        if text[0] == 'batch':
+            command = text[1].split() if len(text) > 1 else []
+
+            if command == ['run']:
+                with eod_batches_lock:
+                    batch = eod_batches.get(m.from_user.id)
+                if not batch or not batch['files']:
+                    bot.send_message(m.from_user.id, 'No dispatch files in the batch yet')
+                    return
+
+                # the webhook doesn't wait for the days to be reconciled
+                threading.Thread(target=run_eod_batch, args=(m.from_user.id,), daemon=True).start()
+                bot.send_message(m.from_user.id, 'Reconciling ' + str(len(batch['files'])) + ' day(s)...')
+                return
+
+            if command == ['cancel']:
+                with eod_batches_lock:
+                    eod_batches.pop(m.from_user.id, None)
+                bot.send_message(m.from_user.id, 'Batch cancelled')
+                return
+
+            first = normalize_date(command[0]) if command else ''
+            last = normalize_date(command[1]) if len(command) > 1 else first
+            try:
+                days = date_range(first, last)
+            except ValueError:
+                days = []
+            if not 0 < len(days) <= eod_batch_max_days:
+                bot.send_message(m.from_user.id, 'Second row should be the first and last day of the batch'
+                                                 '(M/D/YYYY), ' + str(eod_batch_max_days) + ' days at most')
+                return
+
+            tenant = get_tenant(user)
+            open_eod_batch(tenant, m.from_user.id, first, last, as_of=get_as_of_snapshot(tenant, m.from_user.id))
+            bot.send_message(m.from_user.id, 'Batch ' + first + ' - ' + last + ' opened, upload the dispatch file of '
+                                             'every day(.csv, the date in the caption or the file name), then send '
+                                             '"batch" with "run" in the second row')
+            return
+
         if text[0] == 'add':
             todo_user = Users.query.filter_by(id=int(text[1])).first()
 
@@ -771,6 +3104,20 @@ def messages(m):
                 bot.send_message(m.from_user.id, 'User not found')
             return
 
+        if text[0] == 'tenant':
+            todo_user = Users.query.filter_by(id=int(text[1])).first()
+
+            if not todo_user:
+                bot.send_message(m.from_user.id, 'User not found')
+            elif len(text) < 3 or text[2].strip() not in tenants:
+                bot.send_message(m.from_user.id, 'Tenant not found, tenants: ' + ', '.join(tenants))
+            else:
+                todo_user.tenant = text[2].strip()
+                db.session.commit()
+                as_of_snapshots.pop(todo_user.id, None)
+                bot.send_message(m.from_user.id, 'User moved to ' + todo_user.tenant)
+            return
+
         if text[0] == 'remove':
             todo_user = Users.query.filter_by(id=int(text[1])).first()
 
@@ -794,7 +3141,7 @@ def messages(m):
             return
 
         if m.text == 'Change to search':
-            message, reply_markup = build_menu(2, is_admin=is_bot_admin(m.from_user.id))
+            message, reply_markup = build_menu(2, user=user, is_admin=is_bot_admin(m.from_user.id))
             user.position_in_menu = 2
             db.session.commit()
             bot.send_message(m.from_user.id, message, reply_markup=reply_markup)
@@ -802,11 +3149,41 @@ def messages(m):
 
         if m.text == 'Current mode: "EOD"':
             bot.send_message(m.from_user.id, 'Just paste the info in "MOVE_ID CONTAINER_NUMBER MOVE_TYPE" format\n\n'
-                                             'To update the completed moves log just upload the .csv file here.')
+                                             'A paste too long for one message is checked as a whole once all of '
+                                             'it has arrived, click "Check" to check it right away\n\n'
+                                             'Start the paste with the row "reconcile DATE AM/PM"(M/D/YYYY, shift '
+                                             'optional) to also get the moves of that day Yusen has and we '
+                                             'did not dispatch\n\n'
+                                             'For a long list(month end) upload it as a .csv file(MOVE_ID, '
+                                             'CONTAINER_NUMBER, MOVE_TYPE columns) with the caption "eod", the '
+                                             'issues come back as a .csv file\n\n'
+                                             'To update the completed moves log just upload the .csv file here'
+                                             '(or a .csv.gz/.zip of it). '
+                                             'Add the caption "merge" to the file to only add/update the moves '
+                                             'in it.\n\n'
+                                             'The "Scope" button sets how many months of the log are looked at.\n\n'
+                                             '/stats - statistics of the completed moves log')
             return
 
-        for i in EOD_logic_check(m.text):
-            bot.send_message(m.from_user.id, i)
+        # loops thru the scope options
+        if m.text.startswith('Scope: '):
+            months = get_search_scope(m.from_user.id)
+            search_scopes[m.from_user.id] = search_scope_options[(search_scope_options.index(months) + 1) %
+                                                                 len(search_scope_options)]
+            message, reply_markup = build_menu(1, user=user)
+            bot.send_message(m.from_user.id, 'Scope changed to ' + search_scope_label(get_search_scope(m.from_user.id)),
+                             reply_markup=reply_markup)
+            return
+
+        # checks the paste gathered so far right away
+        if m.text == 'Check':
+            if not run_eod_session(m.from_user.id):
+                bot.send_message(m.from_user.id, 'Nothing to check, paste the EOD list first')
+            return
+
+        tenant = get_tenant(user)
+        add_to_eod_session(tenant, m.from_user.id, m.text, as_of=get_as_of_snapshot(tenant, m.from_user.id),
+                           months=get_search_scope(m.from_user.id))
         return
 
     # Search in completed moves log logic
@@ -819,7 +3196,7 @@ def messages(m):
             return
 
         if m.text == 'Change to EOD':
-            message, reply_markup = build_menu(1, is_admin=is_bot_admin(m.from_user.id))
+            message, reply_markup = build_menu(1, user=user, is_admin=is_bot_admin(m.from_user.id))
             user.position_in_menu = 1
             db.session.commit()
             bot.send_message(m.from_user.id, message, reply_markup=reply_markup)
@@ -828,16 +3205,40 @@ def messages(m):
         if m.text == 'Current mode: "SEARCH"':
             bot.send_message(m.from_user.id, 'Paste full MOVE_ID, last 4 of the MOVE_ID, or the CONTAINER_NUMBER to '
                                              'search for a match in the completed moves log\n\n'
-                                             'To update the completed moves log just upload the .csv file here.')
+                                             'Paste several of them, one per row, to search for all of them at once, '
+                                             'long results come a page at a time(buttons under the results)\n\n'
+                                             'To update the completed moves log just upload the .csv file here'
+                                             '(or a .csv.gz/.zip of it). '
+                                             'Add the caption "merge" to the file to only add/update the moves '
+                                             'in it.\n\n'
+                                             'The "Scope" button sets how many months of the log are looked at.\n\n'
+                                             '/stats - statistics of the completed moves log')
+            return
+
+        # loops thru the scope options
+        if m.text.startswith('Scope: '):
+            months = get_search_scope(m.from_user.id)
+            search_scopes[m.from_user.id] = search_scope_options[(search_scope_options.index(months) + 1) %
+                                                                 len(search_scope_options)]
+            message, reply_markup = build_menu(2, user=user)
+            bot.send_message(m.from_user.id, 'Scope changed to ' + search_scope_label(get_search_scope(m.from_user.id)),
+                             reply_markup=reply_markup)
             return
 
-        res = search_for_an_ID_or_row(m.text)
+        # several rows are searched as a list in one go
+        tenant = get_tenant(user)
+        months = get_search_scope(m.from_user.id)
+        if len(m.text.strip().split('\n')) > 1:
+            res = search_for_a_list(tenant, m.text, as_of=get_as_of_snapshot(tenant, m.from_user.id), months=months)
+        else:
+            res = search_for_an_ID_or_row(tenant, m.text.strip(), as_of=get_as_of_snapshot(tenant, m.from_user.id),
+                                          months=months)
         if res:
-            for i in res:
-                bot.send_message(m.from_user.id, i)
+            send_search_result(m.from_user.id, res)
             return
 
-        bot.send_message(m.from_user.id, 'Not found')
+        bot.send_message(m.from_user.id, 'Not found' + ('' if not months else ' in the ' + search_scope_label(months) +
+                                                        ', the "Scope" button widens the search'))
         return
 
     # BOBTAILS logic
@@ -903,7 +3304,7 @@ def messages(m):
             bot.send_message(m.from_user.id, message, reply_markup=reply_markup)
             return
 
-        res = split_sort_current_work(m.text)
+        res = split_sort_current_work(get_tenant(user), m.text)
         if res:
             for i in res:
                 bot.send_message(m.from_user.id, i, parse_mode='MarkdownV2')
@@ -922,44 +3323,46 @@ def message_document(m):
     if not user:
         return
 
+    # dispatch file of a day of an admin's batch
+    if user.position_in_menu == 0 and is_bot_admin(m.from_user.id) and m.from_user.id in eod_batches:
+        date = dispatch_file_date(m.caption, m.document.file_name)
+        if not date:
+            bot.send_message(m.from_user.id, 'Put the date of the file in the caption(M/D/YYYY)')
+            return
+
+        ahead = queue_completed_moves_upload(get_tenant(user), m.from_user.id, m.document.file_id, 'batch', date)
+        bot.send_message(m.from_user.id, 'File received, processing...' +
+                         ('' if not ahead else '\n' + str(ahead) + ' upload(s) ahead of it'))
+        return
+
     if not (user.position_in_menu == 1 or user.position_in_menu == 2):
         return
 
     # Upload and verification of the file send to the bot
     try:
-        file_path_unverified = 'temp/completed_moves_unverified.csv'
-        web_file_info = bot.get_file(m.document.file_id)
-        web_file = requests.get(f'https://api.telegram.org/file/bot{token}/{web_file_info.file_path}')
-        file_unverified = open(file_path_unverified, 'w')
-        file_unverified.write(web_file.text)
-        file_unverified.close()
-        print('File from user successfully uploaded to: "' + file_path_unverified + '"')
-
-        file_unverified = open(file_path_unverified, 'r')
-        csv_reader = csv.reader(file_unverified)
-        header = next(csv_reader)
-
-        if header != ['Month', 'Year Helper', 'Driver Name (Last, First)', 'Unique Move ID', 'Container Number',
-                      'Inbound or Outbound', 'Load Status', 'Shift to move', 'Status', 'Created date']:
-            bot.send_message(m.from_user.id, 'File error, Completed moves log has not been updated')
+        # "merge" caption - only add/update the moves of the file instead of replacing the log,
+        # "eod" caption - the file is a dispatch list to check against the log
+        caption = (m.caption or '').strip().lower()
+        kind = caption if caption in ('merge', 'eod') else 'full'
+        tenant = get_tenant(user)
+        if kind == 'merge' and not completed_moves_log_exists(tenant):
+            bot.send_message(m.from_user.id, 'There is no completed moves log to merge into, upload the full log first')
+            return
+        if kind == 'eod' and not completed_moves_log_exists(tenant):
+            bot.send_message(m.from_user.id, 'There is no completed moves log to check against, upload it first')
             return
 
-        rows = []
-
-        for i in csv_reader:
-            rows.append(i)
-
-        file_path_verified = 'temp/completed_moves_verified.csv'
-        with open(file_path_verified, 'w') as file_verified:
-            writer = csv.writer(file_verified)
-            writer.writerow(header)
-            writer.writerows(rows)
-
-        file_unverified.close()
+        if m.document.file_size and m.document.file_size > completed_moves_max_upload_size:
+            bot.send_message(m.from_user.id, 'File is too big, Completed moves log has not been updated')
+            return
 
-        bot.send_message(m.from_user.id, 'File updated succesfully')
+        # ingested in the background, the webhook doesn't wait for it
+        ahead = queue_completed_moves_upload(tenant, m.from_user.id, m.document.file_id, kind)
+        bot.send_message(m.from_user.id, 'File received, processing...' +
+                         ('' if not ahead else '\n' + str(ahead) + ' upload(s) ahead of it') +
+                         ('' if kind == 'eod' else '\nEOD and search use the current log until it is done'))
 
     except Exception as e:
-        print('Error uploading and saving the file')
+        print('Error uploading and saving the file: ' + str(e))
         bot.send_message(m.from_user.id, 'Error uploading the file, please try again later or contact support')
         return
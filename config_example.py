@@ -13,3 +13,28 @@ mysql_database = 'telebot'
 
 # Unique identifier to this bot
 scac = 'ABCD'  # a 4 letter SCAC Identifier for a company
+
+# Tenants served by this bot, optional: name -> scac, smartsheet_form - id of its bobtail form(optional),
+# path - folder of its completed moves log(optional, temp/<name>/ by default).
+# Users are moved to a tenant with the "tenant" admin command, the ones without a tenant belong to the first one.
+# Without tenants the bot serves scac above only
+# tenants = {
+#     'ABCD': {'scac': 'ABCD', 'path': 'temp/'},
+#     'EFGH': {'scac': 'EFGH', 'smartsheet_form': 'SMARTSHEET FORM ID'},
+# }
+
+# Optional features
+completed_moves_in_db = False  # log in the completed_moves table shared by all workers, filled by the next full upload
+completed_moves_mmap = False  # memory map the verified log and decode only the rows a query returns
+completed_moves_snapshots_kept = 5  # uploads kept on disk for "asof" EOD and search
+completed_moves_partitions_cached = 6  # month partition indexes kept in memory(shared by the kept snapshots)
+completed_moves_max_upload_size = 20 * 1024 * 1024  # bytes
+completed_moves_max_unpacked_size = 200 * 1024 * 1024  # bytes, a .gz/.zip upload once unpacked
+completed_moves_near_matches = False  # "did you mean" hints for mistyped Move IDs in EOD, several times the memory
+eod_results_cached = 100  # EOD replies kept in memory for pastes checked again against the same log
+eod_session_debounce = 2  # seconds to wait for the rest of an EOD paste split over several messages
+eod_document_threshold = 50  # EOD issues above this are sent as a csv document with a summary, 0 - always messages
+eod_batch_processes = 0  # processes reconciling the days of an admin batch, 0 - one per CPU core
+eod_batch_max_days = 31  # days an admin batch can cover
+search_page_size = 20  # rows per page of the search results
+search_results_cached = 100  # search results kept in memory for their next/previous page buttons